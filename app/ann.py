@@ -0,0 +1,138 @@
+import math
+from typing import Optional
+import numpy as np
+
+
+def default_nlist(n: int) -> int:
+    """Number of IVF lists for n rows: about 4 * sqrt(n), the usual starting point."""
+    return max(1, min(n, int(4 * math.sqrt(n))))
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, block_rows: int = 32768) -> np.ndarray:
+    """Index of the nearest centroid for every row of x (|x|^2 is constant per row, so it is dropped)."""
+    c_sq = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), block_rows):
+        block = np.asarray(x[start:start + block_rows], dtype=np.float32)
+        labels[start:start + block_rows] = np.argmin(c_sq - 2.0 * (block @ centroids.T), axis=1)
+    return labels
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """Lloyd's k-means with GEMM-based assignment; empty clusters are re-seeded from random rows."""
+    x = np.asarray(x, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(x, centroids)
+        order = np.argsort(labels, kind="stable")
+        counts = np.bincount(labels, minlength=k)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[nonempty]
+        centroids[nonempty] = np.add.reduceat(x[order], starts, axis=0) / counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = x[rng.choice(len(x), size=len(empty), replace=False)]
+    return centroids
+
+
+class ProductQuantizer:
+    """Splits vectors into m sub-vectors, each coded as one byte (ksub <= 256 centroids)."""
+
+    def __init__(self, dim: int, m: int, ksub: int = 256):
+        if dim % m:
+            raise ValueError(f"PQ sub-quantizer count {m} must divide dimension {dim}")
+        self.dim, self.m, self.ksub = dim, m, ksub
+        self.dsub = dim // m
+        self.codebooks = np.empty((m, ksub, self.dsub), dtype=np.float32)
+
+    def _sub(self, x: np.ndarray, j: int) -> np.ndarray:
+        return x[:, j * self.dsub:(j + 1) * self.dsub]
+
+    def train(self, x: np.ndarray, iters: int = 20, seed: int = 0):
+        self.ksub = min(self.ksub, len(x))
+        self.codebooks = np.stack([kmeans(self._sub(x, j), self.ksub, iters, seed + j) for j in range(self.m)])
+
+    def encode(self, x: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(x), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = assign(self._sub(x, j), self.codebooks[j])
+        return codes
+
+    def distance_table(self, q: np.ndarray) -> np.ndarray:
+        """(m, ksub) squared distances from each sub-vector of q to its codebook."""
+        diff = self.codebooks - q.reshape(self.m, 1, self.dsub)
+        return np.einsum("mkd,mkd->mk", diff, diff)
+
+    def adc(self, table: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """Asymmetric distance: sum of table lookups, one per sub-quantizer."""
+        return table[np.arange(self.m), codes].sum(axis=1)
+
+
+class IVFIndex:
+    """Inverted-file ANN index over a fixed prefix of a FaceIndex's rows.
+
+    Rows are partitioned by a coarse k-means quantizer; a query only visits the nprobe
+    lists whose centroids are closest. With pq_m > 0 the residuals (row - centroid) are
+    also PQ-coded so candidates can be ranked by table lookups before the caller
+    re-scores the best of them against the full vectors.
+    """
+
+    def __init__(self, centroids: np.ndarray, list_rows: np.ndarray, list_offsets: np.ndarray,
+                 pq: Optional[ProductQuantizer] = None, codes: Optional[np.ndarray] = None):
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        self.pq = pq
+        self.codes = codes
+
+    @property
+    def size(self) -> int:
+        return len(self.list_rows)
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, nlist: Optional[int] = None, pq_m: int = 0,
+              iters: int = 20, train_size: int = 100_000, seed: int = 0) -> "IVFIndex":
+        n = len(vectors)
+        nlist = min(nlist or default_nlist(n), n)
+        rng = np.random.default_rng(seed)
+        train_rows = np.sort(rng.choice(n, size=min(n, max(train_size, nlist)), replace=False))
+        train = np.asarray(vectors[train_rows], dtype=np.float32)
+        centroids = kmeans(train, nlist, iters, seed)
+
+        labels = assign(vectors, centroids)
+        list_rows = np.argsort(labels, kind="stable")
+        list_offsets = np.searchsorted(labels[list_rows], np.arange(nlist + 1))
+        pq = codes = None
+        if pq_m:
+            pq = ProductQuantizer(vectors.shape[1], pq_m)
+            # 128 points per PQ centroid is plenty; more only slows the 256-way k-means
+            pq_rows = rng.choice(len(train), size=min(len(train), 128 * pq.ksub), replace=False)
+            pq.train(train[pq_rows] - centroids[labels[train_rows[pq_rows]]], iters, seed)
+            # codes are stored in list order so each list's codes are one contiguous slice
+            codes = np.empty((n, pq_m), dtype=np.uint8)
+            block = 65536
+            for start in range(0, n, block):
+                rows = list_rows[start:start + block]
+                residuals = np.asarray(vectors[rows], dtype=np.float32) - centroids[labels[rows]]
+                codes[start:start + len(rows)] = pq.encode(residuals)
+        return cls(centroids, list_rows, list_offsets, pq, codes)
+
+    def candidates(self, probe: np.ndarray, nprobe: int, limit: Optional[int] = None) -> np.ndarray:
+        """Row ids in the nprobe closest lists; with PQ, only the limit best by ADC distance."""
+        d = np.einsum("ij,ij->i", self.centroids - probe, self.centroids - probe)
+        nprobe = min(nprobe, self.nlist)
+        lists = np.argpartition(d, nprobe - 1)[:nprobe] if nprobe < self.nlist else np.arange(self.nlist)
+        spans = [(self.list_offsets[l], self.list_offsets[l + 1]) for l in lists]
+        rows = np.concatenate([self.list_rows[a:b] for a, b in spans])
+        if self.pq is None or limit is None or len(rows) <= limit:
+            return rows
+        approx = np.concatenate([
+            self.pq.adc(self.pq.distance_table(probe - self.centroids[l]), self.codes[a:b])
+            for l, (a, b) in zip(lists, spans)
+        ])
+        return rows[np.argpartition(approx, limit - 1)[:limit]]
@@ -0,0 +1,126 @@
+import sys
+import copy
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+_MISSING = object()
+
+
+def _approx_size(obj: Any) -> int:
+    """Rough resident size of a cached value: array buffers plus container overheads."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(np.empty(0))
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(_approx_size(k) + _approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sys.getsizeof(obj) + sum(_approx_size(v) for v in obj)
+    return sys.getsizeof(obj)
+
+
+class ProbeCache:
+    """LRU cache of probe encodings and search results within an approximate byte budget.
+
+    Probes are keyed by the SHA-256 of the uploaded bytes, so re-submitting the same photo
+    skips decode and face detection. Results are keyed by (probe hash, search parameters)
+    and tagged with the index generation they were computed at (FaceIndex.generation);
+    the first lookup at a newer generation drops every cached result, while encodings,
+    which do not depend on the index, stay. A result list computed for top_k answers any
+    smaller top_k by its prefix.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._generation = 0
+        self._counts = {"probe_hits": 0, "probe_misses": 0, "result_hits": 0,
+                        "result_misses": 0, "evictions": 0}
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def probe(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Encoding(s) of the probe with content hash key, computed on a miss (None is cached too)."""
+        value = self._get(("probe", key), "probe")
+        if value is _MISSING:
+            value = compute()
+            self._put(("probe", key), value)
+        return value
+
+    def results(self, key: str, params: Tuple, top_k: int, generation: int,
+                compute: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+        """Top-k results of probe key for params at index generation, computed on a miss.
+
+        Returned lists are copies, so callers may annotate them.
+        """
+        entry = self.lookup(key, params, top_k, generation)
+        if entry is not None:
+            return entry
+        results = compute()
+        self.store(key, params, top_k, generation, results)
+        return results
+
+    def lookup(self, key: str, params: Tuple, top_k: int, generation: int) -> Optional[List[Dict[str, Any]]]:
+        with self._lock:
+            self._check_generation(generation)
+        cached = self._get(("results", key, params), "result", lambda v: v[0] >= top_k)
+        if cached is _MISSING:
+            return None
+        return copy.deepcopy(cached[1][:top_k])
+
+    def store(self, key: str, params: Tuple, top_k: int, generation: int,
+              results: List[Dict[str, Any]]):
+        with self._lock:
+            # results of a search that raced with an index update are already stale
+            if not self._check_generation(generation):
+                return
+        self._put(("results", key, params), (top_k, copy.deepcopy(results)))
+
+    def _check_generation(self, generation: int) -> bool:
+        # called with the lock held; True if generation is the current one
+        if generation > self._generation:
+            for k in [k for k in self._entries if k[0] == "results"]:
+                self._bytes -= self._entries.pop(k)[1]
+            self._generation = generation
+        return generation == self._generation
+
+    def _get(self, key: Hashable, kind: str, usable: Callable[[Any], bool] = lambda v: True) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and usable(entry[0]):
+                self._entries.move_to_end(key)
+                self._counts[kind + "_hits"] += 1
+                return entry[0]
+            self._counts[kind + "_misses"] += 1
+            return _MISSING
+
+    def _put(self, key: Hashable, value: Any):
+        size = _approx_size(key) + _approx_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self._counts["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "max_bytes": self.max_bytes, "generation": self._generation, **self._counts}
@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised instead of queueing when a BoundedExecutor is already at its limit."""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Server is busy, retry later")
+        self.retry_after = retry_after
+
+
+class BoundedExecutor:
+    """Runs blocking work off the event loop with a hard cap on admitted calls.
+
+    At most ``max_workers`` calls execute at once and up to ``max_pending`` more may wait;
+    anything beyond that fails fast with ExecutorSaturated so callers can answer 503
+    instead of letting latency grow without bound. OpenCV and NumPy release the GIL, so
+    a thread pool gives real parallelism for decode, detection and the distance scan.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int = 0, retry_after: int = 1,
+                 name: str = "cpu"):
+        self.max_workers = max_workers
+        self.limit = max_workers + max_pending
+        self.retry_after = retry_after
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # only touched from the event loop thread, so no lock is needed
+        self._admitted = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._admitted
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        if self._admitted >= self.limit:
+            raise ExecutorSaturated(self.retry_after)
+        self._admitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self._admitted -= 1
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+class ReadWriteLock:
+    """Any number of concurrent readers, or a single writer.
+
+    Writer-preferring: once a writer is waiting, new readers queue behind it, so a
+    steady stream of searches cannot starve an index update.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
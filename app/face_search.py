@@ -1,96 +1,1023 @@
 ﻿import os
-import pickle
-from typing import List, Dict, Any, Optional
+import json
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import repeat
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Iterator
 import numpy as np
 from PIL import Image
 import cv2
 import io
 
+from . import metrics
+from .ann import IVFIndex
+from .index_info import read_info, write_info
+from .fileio import write_atomic
+from .store import EncodingStore
+
+# 8x8x8 BGR colour histogram produced by _extract_face_encodings
+ENCODING_DIM = 8 * 8 * 8
+# recorded in the index metadata; change it whenever encodings stop being comparable
+ENCODER_VERSION = "haar-bgr-hist-8x8x8/1"
+
+logger = logging.getLogger(__name__)
+
+# per-process; index workers send theirs back with each file (see _encode_file)
+STAGE_SECONDS = metrics.Histogram("facesearch_stage_seconds", "Time spent in each pipeline stage", ["stage"])
+IMAGES_INDEXED = metrics.Counter("facesearch_images_indexed_total", "Image files encoded into the index")
+FACES_DETECTED = metrics.Counter("facesearch_faces_detected_total", "Faces found by the detector", ["source"])
+NO_FACE_PROBES = metrics.Counter("facesearch_no_face_probes_total", "Probe images in which no face was found")
+ERRORS = metrics.Counter("facesearch_errors_total", "Images that could not be decoded or encoded", ["source"])
+# set_function'd by whichever server owns the index, so both can be imported in one process
+INDEX_FACES = metrics.Gauge("facesearch_index_faces", "Faces in the resident search index")
+INDEX_BYTES = metrics.Gauge("facesearch_index_resident_bytes", "Bytes of the resident index arrays")
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a pipeline stage into STAGE_SECONDS and the current request trace, if any.
+
+    Usable as a decorator; stages are load, decode, detect, encode, thumbnail and scan.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.labels(stage=name).observe(elapsed)
+        current = metrics.current_trace()
+        if current is not None:
+            current.add(name, elapsed)
+
 
 def ensure_dir(path: str):
     os.makedirs(path, exist_ok=True)
 
 
-def load_encodings(path: str) -> List[Dict[str, Any]]:
+@stage("load")
+def open_store(root: str, legacy_path: Optional[str] = None) -> EncodingStore:
+    return EncodingStore.open(root, ENCODING_DIM, legacy_path=legacy_path)
+
+
+def manifest_path(store_root: str) -> str:
+    return os.path.join(store_root, "manifest.json")
+
+
+def index_info_path(store_root: str) -> str:
+    return os.path.join(store_root, "index_info.json")
+
+
+def _encoder_id(detect_kwargs: Dict[str, Any]) -> str:
+    max_side = detect_kwargs.get("max_side", 0)
+    return f"{ENCODER_VERSION};max_side={max_side}" if max_side else ENCODER_VERSION
+
+
+def _dir_bytes(root: str) -> int:
+    return sum(e.stat().st_size for e in os.scandir(root) if e.is_file())
+
+
+def update_index_info(store: EncodingStore, manifest: Dict[str, Dict[str, Any]],
+                      bump: bool = True, **detect_kwargs) -> Dict[str, Any]:
+    """Rewrite the metadata record of the index at store.root (see index_info)."""
+    return write_info(index_info_path(store.root), faces=len(store), files=len(manifest),
+                      encoder=_encoder_id(detect_kwargs), nbytes=_dir_bytes(store.root), bump=bump)
+
+
+def load_index_info(store: EncodingStore, **detect_kwargs) -> Dict[str, Any]:
+    """The metadata record of the index at store.root, created on first use for older indexes."""
+    path = index_info_path(store.root)
     if not os.path.exists(path):
-        return []
+        return update_index_info(store, load_manifest(manifest_path(store.root)), bump=False, **detect_kwargs)
+    return read_info(path)
+
+
+def load_manifest(path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: Dict[str, Dict[str, Any]], path: str):
+    write_atomic(path, json.dumps(manifest).encode("utf-8"))
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha256()
     with open(path, "rb") as f:
-        return pickle.load(f)
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _reduction(width: int, height: int, max_side: int) -> int:
+    """Largest JPEG DCT scale denominator (1, 2, 4 or 8) keeping the long side >= max_side."""
+    if max_side:
+        for factor in (8, 4, 2):
+            if max(width, height) >= max_side * factor:
+                return factor
+    return 1
+
+
+_IMREAD_REDUCED = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+
+@stage("decode")
+def load_image(path: str, max_side: int = 0) -> Tuple[Optional[np.ndarray], float]:
+    """BGR image from path (None if undecodable) and the scale back to full resolution.
+
+    With max_side, JPEGs are decoded by libjpeg at 1/2, 1/4 or 1/8 size, as long as the
+    long side stays at least max_side; other formats are decoded and then shrunk.
+    """
+    factor = 1
+    if max_side:
+        try:
+            with Image.open(path) as im:
+                full_width = im.size[0]
+                factor = _reduction(*im.size, max_side)
+        except OSError:
+            pass
+    img = cv2.imread(path, _IMREAD_REDUCED[factor] if factor > 1 else cv2.IMREAD_COLOR)
+    if img is None or factor == 1:
+        return img, 1.0
+    return img, full_width / img.shape[1]
+
+
+@stage("decode")
+def decode_image_bytes(file_bytes: bytes, max_side: int = 0) -> Tuple[np.ndarray, float]:
+    """BGR image from encoded bytes and the scale back to full resolution (see load_image)."""
+    image = Image.open(io.BytesIO(file_bytes))
+    full_width = image.size[0]
+    metrics.note("image", {"format": image.format, "width": image.size[0], "height": image.size[1]})
+    factor = _reduction(*image.size, max_side)
+    if factor > 1:
+        # JPEG only: libjpeg decodes straight to the smallest DCT scale >= the requested size
+        image.draft("RGB", (-(-image.size[0] // factor), -(-image.size[1] // factor)))
+    image = image.convert("RGB")
+    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR), full_width / image.size[0]
+
+
+def image_bytes_to_array(file_bytes: bytes, max_side: int = 0):
+    return decode_image_bytes(file_bytes, max_side)[0]
+
+
+CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
 
+# CascadeClassifier is not safe to share across threads, so every thread (and therefore
+# every worker process) lazily loads its own copy of the model and then reuses it.
+_detector_local = threading.local()
 
-def save_encodings(encodings: List[Dict[str, Any]], path: str):
-    with open(path, "wb") as f:
-        pickle.dump(encodings, f)
 
+def get_face_detector() -> "cv2.CascadeClassifier":
+    cascade = getattr(_detector_local, "cascade", None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(CASCADE_PATH)
+        if cascade.empty():
+            raise RuntimeError(f"Could not load Haar cascade from {CASCADE_PATH}")
+        _detector_local.cascade = cascade
+    return cascade
 
-def image_bytes_to_array(file_bytes: bytes):
-    image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
 
+@stage("detect")
+def detect_faces(gray, scale_factor: float = 1.1, min_neighbors: int = 4,
+                 min_size: Tuple[int, int] = (0, 0)):
+    # same boxes as detectMultiScale, plus how many candidate windows were merged into each
+    faces, windows = get_face_detector().detectMultiScale2(
+        gray, scaleFactor=scale_factor, minNeighbors=min_neighbors, minSize=min_size)
+    metrics.note("detect", {"width": gray.shape[1], "height": gray.shape[0], "faces": len(faces),
+                            "candidate_windows": int(np.sum(windows)) if len(faces) else 0})
+    return faces
 
-def _extract_face_encodings(image_cv) -> List[np.ndarray]:
-    encodings = []
+
+def _extract_faces(image_cv, max_side: int = 0, scale: float = 1.0,
+                   **detect_kwargs) -> List[Tuple[Tuple[int, int, int, int], np.ndarray]]:
+    """(x, y, w, h) box and encoding for every detected face, in detector order.
+
+    With max_side the cascade runs on a copy whose long side is max_side and the boxes
+    are mapped back, so faces are still cropped from image_cv. Boxes are multiplied by
+    scale, i.e. reported at full resolution when image_cv was decoded reduced.
+    """
+    faces_out = []
     gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    faces = cascade.detectMultiScale(gray, 1.1, 4)
-    
-    for (x, y, w, h) in faces:
-        face_img = image_cv[y:y+h, x:x+w]
-        if face_img.size == 0:
+    shrink = max_side / max(gray.shape) if max_side and max(gray.shape) > max_side else 1.0
+    if shrink < 1.0:
+        gray = cv2.resize(gray, None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+    faces = detect_faces(gray, **detect_kwargs)
+    if not len(faces):
+        return faces_out
+
+    with stage("encode"):
+        for box in faces:
+            x, y, w, h = (int(round(v / shrink)) for v in box)
+            face_img = image_cv[y:y+h, x:x+w]
+            if face_img.size == 0:
+                continue
+            hist = cv2.calcHist([face_img], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
+            hist = cv2.normalize(hist, hist).flatten()
+            faces_out.append((tuple(int(round(v * scale)) for v in (x, y, w, h)), hist))
+    return faces_out
+
+
+def _extract_face_encodings(image_cv, **detect_kwargs) -> List[np.ndarray]:
+    return [enc for _, enc in _extract_faces(image_cv, **detect_kwargs)]
+
+
+# face crops written at index time, so result pages need not fetch the original photo
+THUMB_SIZE = 160
+THUMB_FORMATS = {"jpg": [cv2.IMWRITE_JPEG_QUALITY, 85], "webp": [cv2.IMWRITE_WEBP_QUALITY, 80]}
+# context kept around the detected box, as a fraction of its longer side
+THUMB_MARGIN = 0.2
+
+
+def _thumb_key(file: str) -> str:
+    return hashlib.sha1(file.encode("utf-8")).hexdigest()
+
+
+def thumb_name(file: str, face_index: int, fmt: str = "jpg") -> str:
+    """Path of a face thumbnail relative to the thumbnail folder, derived from the indexed file name."""
+    key = _thumb_key(file)
+    return f"{key[:2]}/{key}-{face_index}.{fmt}"
+
+
+def _face_thumbnail(image_cv, box, scale: float, size: int) -> np.ndarray:
+    # box is in full-resolution pixels; image_cv may have been decoded reduced by scale
+    x, y, w, h = (v / scale for v in box)
+    pad = THUMB_MARGIN * max(w, h)
+    rows, cols = image_cv.shape[:2]
+    crop = image_cv[max(int(y - pad), 0):min(int(np.ceil(y + h + pad)), rows),
+                    max(int(x - pad), 0):min(int(np.ceil(x + w + pad)), cols)]
+    shrink = size / max(crop.shape[:2])
+    if shrink < 1.0:
+        crop = cv2.resize(crop, None, fx=shrink, fy=shrink, interpolation=cv2.INTER_AREA)
+    return crop
+
+
+@stage("thumbnail")
+def write_thumbnails(image_cv, faces, scale: float, thumbs_dir: str, file: str,
+                     size: int = THUMB_SIZE, fmt: str = "jpg") -> int:
+    """Write a crop of each (box, encoding) in faces, at most size pixels on its long side."""
+    for i, (box, _) in enumerate(faces):
+        ok, buf = cv2.imencode("." + fmt, _face_thumbnail(image_cv, box, scale, size), THUMB_FORMATS[fmt])
+        if not ok:
+            raise ValueError(f"could not encode {fmt} thumbnail")
+        path = os.path.join(thumbs_dir, thumb_name(file, i, fmt))
+        ensure_dir(os.path.dirname(path))
+        # thumbnails can be regenerated, so they are not worth an fsync each
+        write_atomic(path, buf.tobytes(), durable=False)
+    return len(faces)
+
+
+def remove_thumbnails(thumbs_dir: str, file: str, keep: int = 0, fmt: str = "jpg"):
+    """Delete the thumbnails of file, except those of its first keep faces in format fmt."""
+    key = _thumb_key(file)
+    shard = os.path.join(thumbs_dir, key[:2])
+    try:
+        names = os.listdir(shard)
+    except OSError:
+        return
+    for name in names:
+        stem, _, ext = name.partition(".")
+        owner, _, face = stem.rpartition("-")
+        if owner != key or (ext == fmt and face.isdigit() and int(face) < keep):
             continue
-        hist = cv2.calcHist([face_img], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
-        hist = cv2.normalize(hist, hist).flatten()
-        encodings.append(hist)
-    
-    return encodings
+        try:
+            os.remove(os.path.join(shard, name))
+        except OSError:
+            pass
 
 
-def index_folder(folder: str, encodings_path: str) -> int:
-    ensure_dir(folder)
-    encodings = load_encodings(encodings_path)
-    added = 0
-    
-    for root, _, files in os.walk(folder):
-        for fname in files:
+def _scan_folder(folder: str, manifest: Dict[str, Dict[str, Any]]):
+    """Split the images under folder into (changed, removed, refreshed) against the manifest.
+
+    A file is unchanged when its size and mtime match; if only the stat differs, the
+    content hash decides and the manifest entry is refreshed in place.
+    """
+    changed = []
+    seen = set()
+    refreshed = 0
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for fname in sorted(files):
             if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
                 continue
             fpath = os.path.join(root, fname)
+            rel = os.path.relpath(fpath)
+            seen.add(rel)
             try:
-                img = cv2.imread(fpath)
-                if img is None:
+                st = os.stat(fpath)
+                entry = manifest.get(rel)
+                if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
                     continue
-                face_encs = _extract_face_encodings(img)
-                for i, enc in enumerate(face_encs):
-                    item = {"file": os.path.relpath(fpath), "face_index": i, "encoding": enc}
-                    encodings.append(item)
-                    added += 1
-            except Exception:
+                digest = file_sha256(fpath)
+            except OSError:
+                continue
+            if entry and entry["sha256"] == digest:
+                entry.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+                refreshed += 1
                 continue
+            changed.append((rel, fpath, {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": digest}))
+    removed = [rel for rel in manifest if rel not in seen]
+    return changed, removed, refreshed
+
+
+def _encode_file(fpath: str, detect_kwargs: Dict[str, Any],
+                 thumbs: Optional[Tuple[str, str, int, str]] = None) -> Tuple[List[np.ndarray], Optional[str]]:
+    """Decode and encode one image file, returning (encodings, error).
+
+    thumbs, if given, is (thumbs_dir, file, size, fmt) for write_thumbnails; a thumbnail
+    that cannot be written is logged and does not fail the file.
+    """
+    try:
+        img, scale = load_image(fpath, detect_kwargs.get("max_side", 0))
+        if img is None:
+            return [], "could not decode image"
+        faces = _extract_faces(img, scale=scale, **detect_kwargs)
+    except Exception as e:
+        return [], f"{type(e).__name__}: {e}"
+    if thumbs is not None:
+        try:
+            write_thumbnails(img, faces, scale, *thumbs)
+        except Exception as e:
+            logger.warning("Could not write thumbnails for %s: %s", fpath, e)
+    return [enc for _, enc in faces], None
+
+
+def _encode_file_observed(fpath: str, detect_kwargs: Dict[str, Any], thumbs=None):
+    # run in pool workers, whose metrics would otherwise stay in the worker process
+    with metrics.capture() as observed, metrics.trace(details=False) as timings:
+        encs, error = _encode_file(fpath, detect_kwargs, thumbs)
+    return encs, error, observed, timings.timings
+
+
+# the pool is started from a thread of a server that runs others (event loop, search and
+# IVF build threads); a fork would copy locks they hold, e.g. OpenCV's or the allocator's
+_POOL_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def _init_index_worker():
+    # the pool already runs one process per core; OpenCV's own threads would oversubscribe it
+    cv2.setNumThreads(1)
+
+
+def _encode_files(paths: List[str], detect_kwargs: Dict[str, Any], workers: int,
+                  chunk_size: int, thumbs: Optional[List[tuple]] = None) -> Iterator[Tuple[List[np.ndarray], Optional[str]]]:
+    """Yield _encode_file results in the order of paths, sharded across a process pool."""
+    thumbs = repeat(None) if thumbs is None else thumbs
+    if workers <= 1 or len(paths) <= 1:
+        yield from map(_encode_file, paths, repeat(detect_kwargs), thumbs)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths)), initializer=_init_index_worker,
+                             mp_context=multiprocessing.get_context(_POOL_START_METHOD)) as pool:
+        current = metrics.current_trace()
+        for encs, error, observed, timings in pool.map(_encode_file_observed, paths, repeat(detect_kwargs),
+                                                       thumbs, chunksize=chunk_size):
+            metrics.replay(observed)
+            if current is not None:
+                current.merge(timings)
+            yield encs, error
+
+
+def index_folder(folder: str, store: EncodingStore, index: Optional["FaceIndex"] = None,
+                 workers: Optional[int] = 1, chunk_size: int = 16, progress=None,
+                 thumbs_dir: Optional[str] = None, thumb_size: int = THUMB_SIZE,
+                 thumb_format: str = "jpg", **detect_kwargs) -> Dict[str, Any]:
+    """Encode only new or modified images under folder and drop faces of removed ones.
+
+    With workers > 1 (None = one per CPU) files are encoded in a process pool, submitted
+    in chunks of chunk_size; results are merged in folder order, so the stored index is
+    the same as a serial run. progress, if given, is told the number of changed files via
+    progress.start(total) and each outcome via progress.file_done(file, faces, error)
+    (see jobs.IndexJob). detect_kwargs are passed to detect_faces, except max_side,
+    which decodes and detects at reduced resolution (see load_image, _extract_faces).
+    With thumbs_dir, a crop of every face is written there (see thumb_name) by the same
+    worker that decoded the image, and thumbnails of re-encoded or removed files are
+    cleaned up.
+    """
+    if thumbs_dir is not None and thumb_format not in THUMB_FORMATS:
+        raise ValueError(f"Unknown thumbnail format {thumb_format!r}; expected one of {', '.join(THUMB_FORMATS)}")
+    ensure_dir(folder)
+    mpath = manifest_path(store.root)
+    manifest = load_manifest(mpath)
+    changed, removed, refreshed = _scan_folder(folder, manifest)
+    new_items = []
+    errors = []
+    
+    if progress is not None:
+        progress.start(len(changed))
+    workers = workers or os.cpu_count() or 1
+    thumbs = None
+    if thumbs_dir is not None:
+        thumbs = [(thumbs_dir, rel, thumb_size, thumb_format) for rel, _, _ in changed]
+    results = _encode_files([fpath for _, fpath, _ in changed], detect_kwargs, workers, chunk_size, thumbs)
+    for (rel, _, entry), (face_encs, error) in zip(changed, results):
+        if thumbs_dir is not None:
+            # the file may have had more faces before it was replaced
+            remove_thumbnails(thumbs_dir, rel, keep=len(face_encs), fmt=thumb_format)
+        for i, enc in enumerate(face_encs):
+            new_items.append({"file": rel, "face_index": i, "encoding": enc})
+        entry["faces"] = len(face_encs)
+        if error:
+            entry["error"] = error
+            errors.append({"file": rel, "error": error})
+            logger.warning("Could not index %s: %s", rel, error)
+        manifest[rel] = entry
+        if progress is not None:
+            progress.file_done(rel, len(face_encs), error)
+    IMAGES_INDEXED.inc(len(changed) - len(errors))
+    FACES_DETECTED.labels(source="index").inc(len(new_items))
+    ERRORS.labels(source="index").inc(len(errors))
+    for rel in removed:
+        del manifest[rel]
+        if thumbs_dir is not None:
+            remove_thumbnails(thumbs_dir, rel)
     
-    save_encodings(encodings, encodings_path)
-    return added
+    # re-encoded files replace whatever was stored for them, even if it predates the manifest
+    stale = set(removed) | {rel for rel, _, _ in changed}
+    store.delete_files(stale)
+    segment = store.append(new_items)
+    if index is not None:
+        index.update(new_items, removed_files=stale, segment=segment)
+    # only once everything else succeeded, so a failed run is retried from scratch
+    if stale or refreshed:
+        save_manifest(manifest, mpath)
+    if stale:
+        update_index_info(store, manifest, **detect_kwargs)
+    return {
+        "files_indexed": len(changed),
+        "files_removed": len(removed),
+        "faces_added": len(new_items),
+        "errors": errors,
+    }
+
 
+def encode_image_bytes(file_bytes: bytes, **detect_kwargs) -> Optional[np.ndarray]:
+    faces = encode_image_faces(file_bytes, **detect_kwargs)
+    return faces[0]["encoding"] if faces else None
 
-def encode_image_bytes(file_bytes: bytes) -> Optional[np.ndarray]:
+
+def encode_image_faces(file_bytes: bytes, **detect_kwargs) -> List[Dict[str, Any]]:
+    """Every face in a probe image as {"box": [x, y, w, h], "encoding": ...}; [] if none."""
     try:
-        arr = image_bytes_to_array(file_bytes)
-        embeds = _extract_face_encodings(arr)
-        if len(embeds) == 0:
-            return None
-        return embeds[0]
+        arr, scale = decode_image_bytes(file_bytes, detect_kwargs.get("max_side", 0))
+        faces = _extract_faces(arr, scale=scale, **detect_kwargs)
     except Exception:
-        return None
+        ERRORS.labels(source="probe").inc()
+        return []
+    FACES_DETECTED.labels(source="probe").inc(len(faces))
+    if not faces:
+        NO_FACE_PROBES.inc()
+    return [{"box": list(box), "encoding": enc} for box, enc in faces]
+
+
+METRICS = ("euclidean", "cosine", "chi_square", "bhattacharyya", "intersection")
+# metrics whose ranking the (Euclidean) IVF index can serve; encodings are L2-normalised,
+# so cosine orders rows exactly like Euclidean distance
+ANN_METRICS = ("euclidean", "cosine")
+_EPS = 1e-12
+
+
+def _dots(probes: np.ndarray, x: np.ndarray, exact: bool) -> np.ndarray:
+    # a GEMM's rounding depends on the shape it is blocked for, so the exact re-score
+    # takes each dot product on its own: the same row then scores the same whichever
+    # candidates it is re-scored with (e.g. a compact index's longer shortlist)
+    return np.einsum("ij,kj->ik", probes, x) if exact else probes @ x.T
+
+
+def _metric_distances(metric: str, probes: np.ndarray, cols: Dict[str, np.ndarray],
+                      exact: bool = True, chunk_rows: int = 8192) -> np.ndarray:
+    """(len(probes), rows) distance matrix, smaller meaning closer, for the rows in cols.
+
+    cosine and bhattacharyya reduce to one GEMM using the per-row norms, sums and
+    sqrt-histograms precomputed by FaceIndex; chi_square and intersection are
+    element-wise and run over chunk_rows rows at a time to bound the temporary. With
+    exact=False euclidean returns squared distances, which rank identically.
+    """
+    x = cols["vectors"]
+    if metric == "euclidean":
+        if exact:
+            return np.stack([np.linalg.norm(x - q, axis=1) for q in probes])
+        probe_sq = np.einsum("ij,ij->i", probes, probes)[:, None]
+        return probe_sq + cols["sq_norms"] - 2.0 * (probes @ x.T)
+    if metric == "cosine":
+        probe_norms = np.linalg.norm(probes, axis=1)[:, None]
+        return 1.0 - _dots(probes, x, exact) / (probe_norms * np.sqrt(cols["sq_norms"]) + _EPS)
+    if metric == "bhattacharyya":
+        # same definition as cv2.HISTCMP_BHATTACHARYYA; the outer sqrt amplifies float32
+        # rounding near zero, so the final re-score recomputes the few winners in float64
+        if exact:
+            x64, q64 = np.maximum(x, 0).astype(np.float64), np.maximum(probes, 0).astype(np.float64)
+            coeff = _dots(np.sqrt(q64), np.sqrt(x64), exact)
+            coeff /= np.sqrt(q64.sum(axis=1)[:, None] * x64.sum(axis=1)) + _EPS
+        else:
+            coeff = np.sqrt(np.maximum(probes, 0)) @ cols["sqrt_vectors"].T
+            coeff /= np.sqrt(probes.sum(axis=1)[:, None] * cols["sums"]) + _EPS
+        return np.sqrt(np.maximum(1.0 - coeff, 0))
+    if metric not in ("chi_square", "intersection"):
+        raise ValueError(f"Unknown metric {metric!r}; expected one of {', '.join(METRICS)}")
+    out = np.empty((len(probes), len(x)), dtype=np.float32)
+    for start in range(0, len(x), chunk_rows):
+        block = np.asarray(x[start:start + chunk_rows])
+        for i, q in enumerate(probes):
+            if metric == "chi_square":
+                # symmetric form, as cv2.HISTCMP_CHISQR_ALT / 2
+                den = block + q
+                out[i, start:start + len(block)] = (np.square(block - q) / np.where(den > 0, den, 1)).sum(axis=1)
+            else:
+                # 1 - Swain & Ballard intersection normalised by the indexed histogram's mass
+                inter = np.minimum(block, q).sum(axis=1)
+                out[i, start:start + len(block)] = 1.0 - inter / np.maximum(cols["sums"][start:start + chunk_rows], _EPS)
+    return out
+
+
+PRECISIONS = ("float32", "float16", "uint8")
+
+
+def _quantize(vectors: np.ndarray, precision: str, block_rows: int = 65536) -> np.ndarray:
+    """Compact codes for a FaceIndex; see _decode.
+
+    uint8 codes sqrt(v) rather than v: histogram bins are in [0, 1] (L2-normalised and
+    non-negative) and mostly small, and the square root spends the 256 levels there.
+    """
+    dtype = np.float16 if precision == "float16" else np.uint8
+    codes = np.empty(vectors.shape, dtype=dtype)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        if dtype is np.uint8:
+            block = np.rint(np.sqrt(np.clip(block, 0, 1)) * 255)
+        codes[start:start + block_rows] = block
+    return codes
+
+
+def _decode(codes: np.ndarray, sqrt: bool = False) -> np.ndarray:
+    """float32 vectors from float16 or uint8 codes, or their square roots if sqrt."""
+    out = codes.astype(np.float32)
+    if codes.dtype == np.uint8:
+        out *= np.float32(1 / 255)
+        if not sqrt:
+            out *= out
+    elif sqrt:
+        np.sqrt(np.maximum(out, 0, out=out), out=out)
+    return out
+
+
+class _DecodedRows:
+    """Read-only float32 view of compact codes, decoded per slice (for IVFIndex.build)."""
+
+    def __init__(self, codes: np.ndarray):
+        self.codes = codes
+        self.shape = codes.shape
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, key) -> np.ndarray:
+        return _decode(self.codes[key])
+
+
+def _smallest_k(values: np.ndarray, k: int) -> np.ndarray:
+    """Column indices of the k smallest entries of each row, in ascending order.
+
+    argpartition selects them in O(N) per row; only the k winners are sorted.
+    """
+    if k < values.shape[1]:
+        part = np.argpartition(values, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(values.shape[1]), values.shape).copy()
+    order = np.argsort(np.take_along_axis(values, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+class FaceIndex:
+    """Resident search index: a contiguous float32 matrix plus parallel per-row arrays.
+
+    Besides the metadata, every row carries statistics derived once at index time
+    (see ``_columns``) so queries only pay for the distance computation. Rows are
+    appended into spare capacity, so readers holding a snapshot are never affected
+    by a concurrent ``add``.
+
+    With precision "float16" or "uint8" (see _quantize) only compact codes are resident:
+    the coarse scan runs over them and the best rerank * top_k candidates are re-scored
+    against the float32 rows, read back from the EncodingStore's memory-mapped segments.
+    Such an index must be built with from_store and fed through update(..., segment=).
+    """
+
+    def __init__(self, dim: int = ENCODING_DIM, precision: str = "float32",
+                 store: Optional[EncodingStore] = None):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown precision {precision!r}; expected one of {', '.join(PRECISIONS)}")
+        self.dim = dim
+        self.precision = precision
+        self._store = store
+        self._lock = threading.Lock()
+        self._size = 0
+        # compact indexes: float32 segment memmaps, referenced by the "sources" column
+        self._sources: List[np.ndarray] = []
+        self._source_ids: Dict[str, int] = {}
+        self._cols = self._columns(np.empty((0, dim), dtype=np.float32), [], [], [], [])
+        # an IVF over rows [0, ann.size); appends keep it usable, removals renumber rows
+        self._ann: Optional[IVFIndex] = None
+        self._row_epoch = 0
+        # bumped by every change that can alter search results (see generation)
+        self._generation = 0
+
+    @property
+    def compact(self) -> bool:
+        return self.precision != "float32"
+
+    def _columns(self, vectors: np.ndarray, files, face_indices,
+                 sources=None, source_rows=None) -> Dict[str, np.ndarray]:
+        cols = {
+            "sq_norms": np.einsum("ij,ij->i", vectors, vectors),
+            "sums": vectors.sum(axis=1, dtype=np.float32),
+            "files": np.array(files, dtype=object).reshape(-1),
+            "face_indices": np.asarray(face_indices, dtype=np.int32).reshape(-1),
+        }
+        if self.compact:
+            cols["codes"] = _quantize(vectors, self.precision)
+            cols["sources"] = np.asarray(sources, dtype=np.int32).reshape(-1)
+            cols["source_rows"] = np.asarray(source_rows, dtype=np.int32).reshape(-1)
+        else:
+            cols["vectors"] = vectors
+        return cols
+
+    def _source_id(self, segment: str) -> int:
+        sid = self._source_ids.get(segment)
+        if sid is None:
+            # mapped once and kept, so rows stay readable even after the store drops the file
+            self._sources.append(self._store.vectors(segment))
+            sid = self._source_ids[segment] = len(self._sources) - 1
+        return sid
+
+    @classmethod
+    def from_encodings(cls, encodings: List[Dict[str, Any]], dim: int = ENCODING_DIM) -> "FaceIndex":
+        index = cls(dim)
+        index.add(encodings)
+        return index
+
+    @classmethod
+    @stage("load")
+    def from_store(cls, store: EncodingStore, precision: str = "float32") -> "FaceIndex":
+        """Build the index from a store; a single clean segment is used as a zero-copy memmap."""
+        index = cls(store.dim, precision, store)
+        parts = []
+        for (vectors, files, face_indices), (name, rows) in zip(store.segments(), store.live_rows()):
+            sources = [index._source_id(name)] * len(rows) if index.compact else None
+            parts.append(index._columns(vectors, files, face_indices, sources, rows))
+        if not parts:
+            return index
+        if len(parts) == 1:
+            index._cols = parts[0]
+        else:
+            index._cols = {name: np.concatenate([p[name] for p in parts]) for name in parts[0]}
+        index._size = len(index._cols["files"])
+        return index
+
+    def save_columns(self, folder: str) -> Dict[str, Any]:
+        """Write the live rows to folder as one .npy file per column and return their layout.
+
+        File names are stored fixed-width, so that column can be memory-mapped as well;
+        see map_columns.
+        """
+        # sqrt_vectors is derived, and only by processes that search with bhattacharyya
+        snap = {name: col for name, col in self.snapshot().items() if name != "sqrt_vectors"}
+        with self._lock:
+            sources = list(self._source_ids)
+        for name, col in snap.items():
+            if col.dtype == object:
+                col = col.astype(str)
+            np.save(os.path.join(folder, name + ".npy"), col, allow_pickle=False)
+        return {"dim": self.dim, "precision": self.precision, "rows": len(snap["files"]),
+                "columns": list(snap), "sources": sources}
+
+    def map_columns(self, folder: str, layout: Dict[str, Any]):
+        """Replace every row with the columns save_columns wrote to folder, as read-only memory maps.
+
+        Processes mapping the same folder share its pages. A later update() copies the
+        columns it touches into this process.
+        """
+        if layout["dim"] != self.dim or layout["precision"] != self.precision:
+            raise ValueError(f"Columns in {folder} are {layout['precision']} x {layout['dim']}, "
+                             f"not {self.precision} x {self.dim}")
+        cols = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="r") for name in layout["columns"]}
+        sources = []
+        for name in layout["sources"]:
+            try:
+                sources.append(self._store.vectors(name))
+            except OSError:
+                # the store dropped the segment together with all of its rows
+                sources.append(np.empty((0, self.dim), dtype=np.float32))
+        with self._lock:
+            self._cols = cols
+            self._size = layout["rows"]
+            self._sources = sources
+            self._source_ids = {name: i for i, name in enumerate(layout["sources"])}
+            self._row_epoch += 1
+            self._ann = None
+            self._generation += 1
+
+    def __len__(self) -> int:
+        return self._size
+
+    def snapshot(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            n = self._size
+            return {name: col[:n] for name, col in self._cols.items()}
+
+    @property
+    def nbytes(self) -> int:
+        """Resident bytes of the per-row arrays (file names count as one pointer each)."""
+        with self._lock:
+            n = self._size
+            return sum(col[:n].nbytes for col in self._cols.values())
+
+    @property
+    def generation(self) -> int:
+        """Counter of changes to the searchable state: rows added or removed, IVF (re)built.
+
+        Results computed at one generation stay valid until it moves on, which is what
+        cache.ProbeCache keys on.
+        """
+        return self._generation
+
+    @property
+    def ann(self) -> Optional[IVFIndex]:
+        return self._ann
+
+    def build_ann(self, nlist: Optional[int] = None, pq_m: int = 0, **build_kwargs) -> Optional[IVFIndex]:
+        """Train an IVF (optionally IVF-PQ) index over the current rows and start using it.
+
+        Rows added afterwards are scanned exactly until the next build; a removal while
+        building discards the result, since row numbers have changed.
+        """
+        with self._lock:
+            n, epoch = self._size, self._row_epoch
+            vectors = _DecodedRows(self._cols["codes"][:n]) if self.compact else self._cols["vectors"][:n]
+        if len(vectors) == 0:
+            return None
+        ann = IVFIndex.build(vectors, nlist=nlist, pq_m=pq_m, **build_kwargs)
+        with self._lock:
+            if self._row_epoch != epoch:
+                return None
+            self._ann = ann
+            self._generation += 1
+        return ann
+
+    def add(self, encodings: List[Dict[str, Any]]) -> int:
+        return self.update(encodings)
+
+    def update(self, encodings: List[Dict[str, Any]], removed_files: Iterable[str] = (),
+               segment: Optional[str] = None) -> int:
+        """Atomically drop every face of removed_files and append encodings.
+
+        segment names the store segment holding encodings (as returned by
+        EncodingStore.append); a compact index needs it to re-score from disk.
+        """
+        # entries written by other encoders (e.g. the 768-bin demo histogram) cannot be compared
+        positions = [i for i, e in enumerate(encodings) if np.size(e["encoding"]) == self.dim]
+        rows = [encodings[i] for i in positions]
+        removed_files = set(removed_files)
+        if not rows and not removed_files:
+            return 0
+        if rows and self.compact and segment is None:
+            raise ValueError("A compact FaceIndex only accepts rows already written to its store")
+        vectors = np.asarray([np.ravel(e["encoding"]) for e in rows], dtype=np.float32).reshape(-1, self.dim)
+        sources = [self._source_id(segment)] * len(rows) if self.compact and rows else []
+        new = self._columns(vectors, [e["file"] for e in rows], [e.get("face_index", 0) for e in rows],
+                            sources, positions)
+
+        with self._lock:
+            if removed_files:
+                self._remove(removed_files)
+            start, end = self._size, self._size + len(rows)
+            if start < end:
+                # columns from from_store or map_columns may be read-only memmaps: copy on write
+                if end > len(self._cols["files"]) or not all(c.flags.writeable for c in self._cols.values()):
+                    self._grow(end)
+                if "sqrt_vectors" in self._cols:
+                    new["sqrt_vectors"] = np.sqrt(np.maximum(new["vectors"], 0))
+                for name, col in self._cols.items():
+                    col[start:end] = new[name]
+            self._size = end
+            self._generation += 1
+        return len(rows)
+
+    def _remove(self, removed_files: set):
+        n = self._size
+        keep = np.fromiter((f not in removed_files for f in self._cols["files"][:n]), dtype=bool, count=n)
+        if keep.all():
+            return
+        # fresh arrays rather than compacting in place, so outstanding snapshots stay valid
+        self._cols = {name: col[:n][keep] for name, col in self._cols.items()}
+        self._size = int(keep.sum())
+        self._row_epoch += 1
+        self._ann = None
+
+    def _add_sqrt_vectors(self):
+        # kept from the first bhattacharyya search on, so other indexes don't hold the rows twice
+        vectors, n = self._cols["vectors"], self._size
+        sqrt_vectors = np.empty(vectors.shape, dtype=np.float32)
+        sqrt_vectors[:n] = np.sqrt(np.maximum(vectors[:n], 0))
+        self._cols["sqrt_vectors"] = sqrt_vectors
+
+    def _grow(self, needed: int):
+        capacity = max(needed, 2 * len(self._cols["files"]), 1024)
+        n = self._size
+        grown = {}
+        for name, col in self._cols.items():
+            # mapped file names are fixed-width (see save_columns); new ones may be longer
+            dtype = object if col.dtype.kind == "U" else col.dtype
+            grown[name] = np.empty((capacity,) + col.shape[1:], dtype=dtype)
+            grown[name][:n] = col[:n]
+        self._cols = grown
+
+    def search(self, encoding: np.ndarray, top_k: int = 5, nprobe: Optional[int] = None,
+               metric: str = "euclidean") -> List[Dict[str, Any]]:
+        return self.search_batch(np.asarray(encoding)[None], top_k, nprobe=nprobe, metric=metric)[0]
+
+    @stage("scan")
+    def search_batch(self, encodings: np.ndarray, top_k: int = 5, block_rows: int = 65536,
+                     nprobe: Optional[int] = None, rerank: int = 8,
+                     metric: str = "euclidean") -> List[List[Dict[str, Any]]]:
+        """Top-k matches for several probes in one pass over the index.
+
+        Exact by default: squared distances come from the expansion |q|^2 + |x|^2 - 2 q.x,
+        i.e. one GEMM per block of block_rows rows against the precomputed row norms, and
+        candidates are picked with argpartition instead of a full sort.
+
+        With nprobe and an ANN built (build_ann), only the rows in the nprobe closest IVF
+        lists plus rows added since the build are considered; with PQ codes, the
+        rerank * top_k best by ADC distance. Either way the final candidates are re-scored
+        exactly, so reported distances match a direct subtraction. A compact index
+        shortlists rerank * top_k rows from its codes and re-scores them from disk.
+
+        metric is one of METRICS (see _metric_distances); every metric costs one O(N*d)
+        pass. The IVF index is only used for ANN_METRICS.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric {metric!r}; expected one of {', '.join(METRICS)}")
+        if nprobe is not None and nprobe < 0:
+            raise ValueError(f"nprobe must be 0 (exact search) or more, not {nprobe}")
+        probes = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock:
+            if metric == "bhattacharyya" and not self.compact and "sqrt_vectors" not in self._cols:
+                self._add_sqrt_vectors()
+            n = self._size
+            snap = {name: col[:n] for name, col in self._cols.items()}
+            ann = self._ann
+            sources = self._sources if self.compact else None
+        if n == 0 or top_k <= 0:
+            return [[] for _ in probes]
+        k = min(top_k, n)
+        shortlist = min(rerank * k, n) if self.compact else k
+        use_ann = bool(nprobe) and ann is not None and metric in ANN_METRICS
+        if use_ann:
+            tail = np.arange(ann.size, n)
+            limit = rerank * k if ann.pq is not None else None
+            rows = [np.concatenate([ann.candidates(p, nprobe, limit), tail]) for p in probes]
+            if self.compact:
+                rows = [self._shortlist(p, r, shortlist, snap, metric) for p, r in zip(probes, rows)]
+        else:
+            # compact blocks are decoded to float32 first, so keep them smaller
+            rows = self._exact_candidates(probes, snap, shortlist,
+                                          min(block_rows, 8192) if self.compact else block_rows, metric)
+        # candidates: rows re-scored exactly, summed over probes
+        metrics.note("scan", {"rows": n, "probes": len(probes), "ann": use_ann,
+                              "candidates": int(sum(len(r) for r in rows))})
+        return [self._rescore(p, r, k, snap, metric, sources) for p, r in zip(probes, rows)]
+
+    def search_files(self, encodings: np.ndarray, top_k: int = 5,
+                     **search_kwargs) -> List[Dict[str, Any]]:
+        """Top-k source files for several faces of one probe image, in one batched pass.
+
+        Each file is ranked by its best face over all probe faces and lists every face
+        hit that contributed. Faces are fetched 4 per wanted file and the pass is
+        repeated with twice as many only if some probe's hits cover fewer than top_k
+        files, so with exact search the file ranking is exact too.
+        """
+        probes = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(probes) == 0 or top_k <= 0:
+            return []
+        k = 4 * top_k
+        while True:
+            per_probe = self.search_batch(probes, top_k=k, **search_kwargs)
+            short = any(len({r["file"] for r in hits}) < top_k for hits in per_probe)
+            if not short or k >= len(self):
+                break
+            k *= 2
+        return group_by_file(per_probe, top_k)
+
+    @staticmethod
+    def _exact_candidates(probes: np.ndarray, snap: Dict[str, np.ndarray], k: int,
+                          block_rows: int, metric: str) -> np.ndarray:
+        n = len(snap["files"])
+        cand_idx, cand_dist = [], []
+        for start in range(0, n, block_rows):
+            block = _scoring_columns(snap, slice(start, start + block_rows), metric=metric)
+            dist = _metric_distances(metric, probes, block, exact=False)
+            best = _smallest_k(dist, min(k, dist.shape[1]))
+            cand_idx.append(best + start)
+            cand_dist.append(np.take_along_axis(dist, best, axis=1))
+        idx = np.concatenate(cand_idx, axis=1)
+        if len(cand_idx) > 1:
+            idx = np.take_along_axis(idx, _smallest_k(np.concatenate(cand_dist, axis=1), k), axis=1)
+        return idx
+
+    @staticmethod
+    def _shortlist(probe: np.ndarray, rows: np.ndarray, k: int,
+                   snap: Dict[str, np.ndarray], metric: str) -> np.ndarray:
+        if len(rows) <= k:
+            return rows
+        dists = _metric_distances(metric, probe[None], _scoring_columns(snap, rows, metric=metric), exact=False)
+        return rows[_smallest_k(dists, k)[0]]
+
+    @staticmethod
+    def _rescore(probe: np.ndarray, rows: np.ndarray, k: int, snap: Dict[str, np.ndarray],
+                 metric: str, sources: Optional[List[np.ndarray]] = None) -> List[Dict[str, Any]]:
+        if len(rows) == 0:
+            return []
+        cols = _scoring_columns(snap, rows, sources)
+        dists = _metric_distances(metric, probe[None], cols, exact=True)[0]
+        order = _smallest_k(dists[None], min(k, len(rows)))[0]
+        files, face_indices = snap["files"], snap["face_indices"]
+        return [
+            {"file": files[rows[i]], "face_index": int(face_indices[rows[i]]), "distance": float(dists[i])}
+            for i in order
+        ]
+
+
+# per-row columns read by _metric_distances
+_SCORING_COLUMNS = ("vectors", "sq_norms", "sums", "sqrt_vectors")
+
+
+def _scoring_columns(snap: Dict[str, np.ndarray], sel, sources: Optional[List[np.ndarray]] = None,
+                     metric: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """_SCORING_COLUMNS for rows sel (a slice or row ids) of a FaceIndex snapshot.
+
+    A compact snapshot's codes are decoded, for the coarse scan of metric only: float16
+    conversion is not vectorised in NumPy, so nothing is decoded that metric won't read.
+    Given the snapshot's sources, the float32 rows are read back from the store segments
+    instead, for the exact re-score (which never reads sqrt_vectors).
+    """
+    if "codes" not in snap:
+        return {name: snap[name][sel] for name in _SCORING_COLUMNS if name in snap}
+    vectors = sqrt_vectors = None
+    if sources is None:
+        if metric == "bhattacharyya":
+            sqrt_vectors = _decode(snap["codes"][sel], sqrt=True)
+        else:
+            vectors = _decode(snap["codes"][sel])
+    else:
+        ids, src_rows = snap["sources"][sel], snap["source_rows"][sel]
+        vectors = np.empty((len(ids), snap["codes"].shape[1]), dtype=np.float32)
+        for sid in np.unique(ids):
+            mask = ids == sid
+            vectors[mask] = sources[sid][src_rows[mask]]
+    return {"vectors": vectors, "sqrt_vectors": sqrt_vectors,
+            "sq_norms": snap["sq_norms"][sel], "sums": snap["sums"][sel]}
+
+
+def combine_results(per_probe: List[List[Dict[str, Any]]], top_k: int = 5) -> List[Dict[str, Any]]:
+    """Fuse several probes of the same person: each face keeps its best distance.
+
+    Exact when every list holds that probe's top_k, since a face in the fused top_k
+    must be in the top_k of the probe closest to it.
+    """
+    best: Dict[Tuple[str, int], Dict[str, Any]] = {}
+    for probe_no, results in enumerate(per_probe):
+        for r in results:
+            key = (r["file"], r["face_index"])
+            if key not in best or r["distance"] < best[key]["distance"]:
+                best[key] = dict(r, probe=probe_no)
+    return sorted(best.values(), key=lambda r: r["distance"])[:top_k]
+
+
+def group_by_file(per_probe: List[List[Dict[str, Any]]], top_k: int = 5) -> List[Dict[str, Any]]:
+    """Group face hits from several probe faces by file, best face first.
+
+    Returns {"file", "distance", "face_index", "probe_face", "hits"} per file, where
+    distance/face_index/probe_face describe the file's best (indexed face, probe face)
+    pair and hits holds each indexed face's best match, sorted by distance.
+    """
+    files: Dict[str, Dict[int, Dict[str, Any]]] = {}
+    for probe_no, results in enumerate(per_probe):
+        for r in results:
+            faces = files.setdefault(r["file"], {})
+            key = r["face_index"]
+            if key not in faces or r["distance"] < faces[key]["distance"]:
+                faces[key] = {"face_index": key, "probe_face": probe_no, "distance": r["distance"]}
+    grouped = []
+    for file, faces in files.items():
+        hits = sorted(faces.values(), key=lambda h: h["distance"])
+        grouped.append(dict(hits[0], file=file, hits=hits))
+    return sorted(grouped, key=lambda g: g["distance"])[:top_k]
 
 
 def find_matches(encoding: np.ndarray, encodings: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
     if len(encodings) == 0:
         return []
-    all_encs = np.vstack([np.array(e["encoding"]) for e in encodings])
-    diffs = all_encs - encoding
-    dists = np.linalg.norm(diffs, axis=1)
-    idx = np.argsort(dists)[:top_k]
-    results = []
-    for i in idx:
-        e = encodings[int(i)]
-        results.append({"file": e["file"], "face_index": e.get("face_index", 0), "distance": float(dists[int(i)])})
-    return results
+    return FaceIndex.from_encodings(encodings, dim=np.size(encoding)).search(encoding, top_k)
@@ -0,0 +1,50 @@
+"""Atomic file replacement used by every writer of index, manifest and metadata files."""
+import os
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+
+def fsync_dir(path: str):
+    # makes a create or rename durable; directories cannot be opened on Windows
+    try:
+        fd = os.open(path or ".", os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def atomic_file(path: str, durable: bool = True) -> Iterator[BinaryIO]:
+    """Binary file that replaces path only when the block exits without an error.
+
+    Readers see the old or the new contents, never a partial write. With durable, the
+    data is fsync'd before the rename and the directory after it, so the same holds
+    after a crash or power loss; derived files such as thumbnails can skip that.
+    """
+    tmp = path + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    if durable:
+        fsync_dir(os.path.dirname(path))
+
+
+def write_atomic(path: str, data: bytes, durable: bool = True):
+    """Replace path with data; see atomic_file."""
+    with atomic_file(path, durable) as f:
+        f.write(data)
@@ -0,0 +1,136 @@
+import os
+import json
+import hashlib
+import tempfile
+import threading
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+from .fileio import write_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is all this can coordinate
+    fcntl = None
+
+ALIASES = "aliases.json"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+class ImageStore:
+    """Uploaded images stored under their content hash, plus the names they were uploaded as.
+
+    Layout under root::
+
+        ab/ab12...ef.jpg        one file per distinct content (SHA-256), sharded by prefix
+
+    and the alias table (aliases.json, kept with the index)::
+
+        {"<sha256>": {"path": "ab/ab12...ef.jpg", "names": ["IMG_0001.jpg", ...]}}
+
+    Re-uploading identical bytes only adds a name, so the indexer never sees a new file,
+    and different photos that share a file name can no longer overwrite each other.
+    Several processes may share one table: flush merges with what is on disk, and the
+    table is re-read whenever another process has rewritten it.
+    """
+
+    def __init__(self, root: str, alias_path: str):
+        self.root = root
+        self.alias_path = alias_path
+        self._lock = threading.Lock()
+        self._aliases: Dict[str, Dict[str, object]] = {}
+        self._dirty = False
+        # (inode, mtime) of the alias file when last read or written
+        self._seen: Optional[Tuple[int, int]] = None
+        os.makedirs(root, exist_ok=True)
+        self._refresh()
+
+    @staticmethod
+    def accepts(filename: str) -> bool:
+        """True if filename has one of IMAGE_EXTENSIONS, the only files the indexer reads."""
+        return os.path.splitext(filename or "")[1].lower() in IMAGE_EXTENSIONS
+
+    def save(self, fileobj: BinaryIO, filename: str, chunk_size: int = 1 << 20) -> Tuple[str, bool]:
+        """Store one upload; returns (path relative to root, True if the content was new).
+
+        The alias table is only written by flush, once per batch of uploads. Raises
+        ValueError unless accepts(filename).
+        """
+        name = os.path.basename(filename or "")
+        if not self.accepts(name):
+            raise ValueError(f"Unsupported image type: {name!r}")
+        ext = os.path.splitext(name)[1].lower()
+        # hidden and extension-less, so a folder scan never picks up a half-written upload
+        fd, tmp = tempfile.mkstemp(prefix=".upload-", dir=self.root)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in iter(lambda: fileobj.read(chunk_size), b""):
+                    digest.update(chunk)
+                    out.write(chunk)
+            sha = digest.hexdigest()
+            with self._lock:
+                self._refresh()
+                entry = self._aliases.get(sha)
+                created = entry is None or not os.path.exists(os.path.join(self.root, entry["path"]))
+                if created:
+                    rel = f"{sha[:2]}/{sha}{ext}"
+                    os.makedirs(os.path.join(self.root, sha[:2]), exist_ok=True)
+                    os.replace(tmp, os.path.join(self.root, rel))
+                    entry = self._aliases[sha] = {"path": rel, "names": []}
+                    self._dirty = True
+                if name and name not in entry["names"]:
+                    entry["names"].append(name)
+                    self._dirty = True
+            return entry["path"], created
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def names(self, rel_path: str) -> List[str]:
+        """Upload names of the image at rel_path (its own name for pre-existing files)."""
+        sha = os.path.splitext(os.path.basename(rel_path))[0]
+        with self._lock:
+            self._refresh()
+            entry = self._aliases.get(sha)
+            return list(entry["names"]) if entry else [os.path.basename(rel_path)]
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            with open(self.alias_path + ".lock", "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    # another process may have added entries since this one last read the table
+                    self._seen = None
+                    self._refresh()
+                    write_atomic(self.alias_path, json.dumps(self._aliases).encode("utf-8"))
+                    self._seen = self._stat()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+            self._dirty = False
+
+    def _stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.alias_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _refresh(self):
+        # called with _lock held; merges the table on disk if it changed since last seen
+        seen = self._stat()
+        if seen is None or seen == self._seen:
+            return
+        try:
+            with open(self.alias_path, "r", encoding="utf-8") as f:
+                on_disk = json.load(f)
+        except (OSError, ValueError):
+            return
+        for sha, theirs in on_disk.items():
+            entry = self._aliases.setdefault(sha, theirs)
+            if entry is not theirs:
+                entry["names"].extend(n for n in theirs["names"] if n not in entry["names"])
+        self._seen = seen
@@ -0,0 +1,39 @@
+"""Small JSON record of index counts and generation, so /api/status does not load the encodings."""
+import os
+import json
+import time
+from typing import Any, Dict
+
+from .fileio import write_atomic
+
+EMPTY = {"faces": 0, "files": 0, "encoder": None, "generation": 0, "bytes": 0, "last_indexed": None}
+
+
+def info_path_for(index_path: str) -> str:
+    """Record path for a single-file index such as data/encodings.pkl."""
+    return os.path.splitext(index_path)[0] + ".info.json"
+
+
+def read_info(path: str) -> Dict[str, Any]:
+    """The record at path, or EMPTY if there is none yet."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {**EMPTY, **json.load(f)}
+    except (OSError, ValueError):
+        return dict(EMPTY)
+
+
+def write_info(path: str, faces: int, files: int, encoder: str, nbytes: int,
+               bump: bool = True) -> Dict[str, Any]:
+    """Replace the record at path and return it.
+
+    bump marks an index change: the generation is incremented and last_indexed set to
+    now. Use bump=False to create the record for an index that predates it.
+    """
+    info = read_info(path)
+    info.update(faces=faces, files=files, encoder=encoder, bytes=nbytes)
+    if bump:
+        info["generation"] += 1
+        info["last_indexed"] = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    write_atomic(path, json.dumps(info).encode("utf-8"))
+    return info
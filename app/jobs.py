@@ -0,0 +1,174 @@
+import os
+import json
+import time
+import uuid
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Any, Optional
+
+from .fileio import write_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class IndexJob:
+    """Progress of one background indexing run.
+
+    Passed to face_search.index_folder as its ``progress`` reporter, which calls
+    ``start`` once the changed files are known and ``file_done`` after each file.
+    With a path, the state is also written there (see IndexJobQueue), at most once
+    per save_interval seconds while files are being indexed.
+    """
+
+    def __init__(self, job_id: str, info: Dict[str, Any], path: Optional[str] = None,
+                 save_interval: float = 1.0):
+        self.id = job_id
+        self.info = info
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.files_total = 0
+        self.files_done = 0
+        self.faces_found = 0
+        self.errors = []
+        self.result: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+        self._path = path
+        self._save_interval = save_interval
+        self._saved_at = 0.0
+
+    def start(self, files_total: int):
+        with self._lock:
+            self.files_total = files_total
+
+    def file_done(self, file: str, faces: int, error: Optional[str] = None):
+        with self._lock:
+            self.files_done += 1
+            self.faces_found += faces
+            if error:
+                self.errors.append({"file": file, "error": error})
+            due = self._path is not None and time.time() - self._saved_at >= self._save_interval
+        if due:
+            self.save()
+
+    def save(self):
+        """Write the current state to the job's path, if it has one."""
+        if self._path is None:
+            return
+        state = self.to_dict()
+        self._saved_at = time.time()
+        try:
+            write_atomic(self._path, json.dumps(state).encode("utf-8"), durable=False)
+        except OSError:
+            logger.warning("Could not save the state of index job %s", self.id, exc_info=True)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            end = self.finished_at or time.time()
+            elapsed = end - self.started_at if self.started_at else 0.0
+            return {
+                "job_id": self.id,
+                "status": self.status,
+                **self.info,
+                "files_total": self.files_total,
+                "files_done": self.files_done,
+                "faces_found": self.faces_found,
+                "errors": list(self.errors),
+                "elapsed_sec": round(elapsed, 3),
+                "files_per_sec": round(self.files_done / elapsed, 2) if elapsed > 0 else 0.0,
+                "result": self.result,
+            }
+
+
+class IndexJobQueue:
+    """Runs indexing jobs one at a time on a background thread.
+
+    Jobs are serialized because index_folder owns the store and manifest while it runs;
+    searches keep using the resident index, which the job swaps in when it finishes.
+    With state_dir, every job's state is also kept there as <job_id>.json, so processes
+    sharing the directory can report on each other's jobs (see status).
+    """
+
+    def __init__(self, run: Callable[[IndexJob], Dict[str, Any]], max_history: int = 100,
+                 state_dir: Optional[str] = None):
+        self._run = run
+        self._max_history = max_history
+        self._state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs: "OrderedDict[str, IndexJob]" = OrderedDict()
+        self._queue: "queue.Queue[IndexJob]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, **info) -> IndexJob:
+        job_id = uuid.uuid4().hex
+        path = os.path.join(self._state_dir, job_id + ".json") if self._state_dir else None
+        job = IndexJob(job_id, info, path)
+        job.save()
+        self._prune_saved()
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self._max_history:
+                oldest = next(iter(self._jobs.values()))
+                if oldest.status in ("queued", "running"):
+                    break
+                self._jobs.popitem(last=False)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name="index-jobs", daemon=True)
+                self._thread.start()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IndexJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """State of a job submitted here or, with state_dir, by any process sharing it."""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self._state_dir is None or not job_id.isalnum():
+            return None
+        try:
+            with open(os.path.join(self._state_dir, job_id + ".json"), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _prune_saved(self):
+        # keeps the max_history most recently updated states; running jobs update theirs
+        if self._state_dir is None:
+            return
+        try:
+            entries = [e for e in os.scandir(self._state_dir) if e.name.endswith(".json")]
+            entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+            for entry in entries[self._max_history:]:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            job.save()
+            try:
+                job.result = self._run(job)
+                job.status = "done"
+            except Exception as e:
+                logger.exception("Index job %s failed", job.id)
+                job.result = {"error": f"{type(e).__name__}: {e}"}
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                job.save()
+                self._queue.task_done()
@@ -1,23 +1,128 @@
 ﻿import os
-from typing import List
+from contextlib import nullcontext
+from typing import List, Optional
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-import shutil
+import threading
+import time
+import numpy as np
 
-from . import face_search
+from . import face_search, metrics
+from .cache import ProbeCache
+from .concurrency import BoundedExecutor, ExecutorSaturated
+from .images import ImageStore, ALIASES
+from .jobs import IndexJobQueue
+from .shared_index import SharedIndexFiles
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))
 DATA_DIR = os.path.join(BASE_DIR, "data")
 IMAGES_DIR = os.path.join(DATA_DIR, "images")
+INDEX_DIR = os.path.join(DATA_DIR, "index")
+# per-face crops written by the indexer and returned as thumb_url; "jpg" or "webp"
+THUMBS_DIR = os.path.join(DATA_DIR, "thumbs")
+THUMB_FORMAT = os.environ.get("THUMB_FORMAT", "jpg")
+# processes used to encode uploaded images; set to 1 for a serial index run
+INDEX_WORKERS = int(os.environ.get("INDEX_WORKERS", os.cpu_count() or 1))
+# probe decode/detect and index scans run on this many threads, with this many more
+# requests allowed to wait; beyond that requests get 503 + Retry-After
+SEARCH_CONCURRENCY = int(os.environ.get("SEARCH_CONCURRENCY", os.cpu_count() or 1))
+SEARCH_QUEUE = int(os.environ.get("SEARCH_QUEUE", 2 * SEARCH_CONCURRENCY))
+# largest top_k a search request may ask for; every result costs a stat and a cached copy
+MAX_TOP_K = int(os.environ.get("MAX_TOP_K", 100))
+# approximate search: an IVF index is trained once the index holds ANN_MIN_FACES faces and
+# searches then visit ANN_NPROBE lists (a request may pass nprobe, 0 meaning exact);
+# ANN_PQ_M > 0 adds PQ codes with that many sub-quantizers (must divide 512)
+ANN_MIN_FACES = int(os.environ.get("ANN_MIN_FACES", 100_000))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 16))
+ANN_PQ_M = int(os.environ.get("ANN_PQ_M", 0))
+# "float16" or "uint8" keeps only compact codes in memory and re-scores the shortlist
+# from the float32 rows on disk (see FaceIndex)
+INDEX_PRECISION = os.environ.get("INDEX_PRECISION", "float32")
+# long side (pixels) faces are detected at; large JPEGs are also decoded reduced
+# (see face_search.load_image). 0 = full resolution. Changing it alters encodings,
+# so set it before the first index run.
+MAX_DETECT_SIDE = int(os.environ.get("MAX_DETECT_SIDE", 0))
+# memory budget (MiB) for probe encodings and search results of recently submitted
+# photos; results are dropped whenever the index changes. 0 disables the cache.
+PROBE_CACHE_MB = float(os.environ.get("PROBE_CACHE_MB", 64))
+# set to 1 under uvicorn --workers N: every worker memory-maps one on-disk copy of the
+# index (see shared_index) instead of building its own, and picks up index runs done by
+# the others. Each indexing job then also rewrites that copy.
+SHARED_INDEX = os.environ.get("SHARED_INDEX", "0") == "1"
+# pre-store pickle, migrated into INDEX_DIR the first time the store is opened
 ENC_PATH = os.path.join(DATA_DIR, "encodings.pkl")
 
 os.makedirs(IMAGES_DIR, exist_ok=True)
+os.makedirs(THUMBS_DIR, exist_ok=True)
+
+# loaded once and shared by every endpoint; index_images refreshes it in place
+STORE = face_search.open_store(INDEX_DIR, legacy_path=ENC_PATH)
+# uploads are stored by content hash; identical bytes are never written or encoded twice
+IMAGES = ImageStore(IMAGES_DIR, os.path.join(INDEX_DIR, ALIASES))
+# writes the metadata record for indexes created before it existed
+_INFO = face_search.load_index_info(STORE, max_side=MAX_DETECT_SIDE)
+if SHARED_INDEX:
+    SHARED = SharedIndexFiles(os.path.join(INDEX_DIR, "shared"))
+    INDEX = SHARED.open(STORE, _INFO["generation"], precision=INDEX_PRECISION)
+else:
+    SHARED = None
+    INDEX = face_search.FaceIndex.from_store(STORE, precision=INDEX_PRECISION)
+PROBES = ProbeCache(int(PROBE_CACHE_MB * (1 << 20)))
+# stage histograms and counters live in face_search; these are read at scrape time
+face_search.INDEX_FACES.set_function(lambda: len(INDEX))
+face_search.INDEX_BYTES.set_function(lambda: INDEX.nbytes)
+
+
+def _refresh_ann():
+    # rebuild when rows were removed (the IVF is dropped) or >10% were added since the build
+    n = len(INDEX)
+    if n < ANN_MIN_FACES:
+        return
+    ann = INDEX.ann
+    if ann is None or n - ann.size > 0.1 * ann.size:
+        INDEX.build_ann(pq_m=ANN_PQ_M)
+
+
+def _sync_index():
+    # another worker may have published a newer index; the IVF is per process, so retrain it
+    if SHARED is not None and SHARED.refresh(INDEX):
+        threading.Thread(target=_refresh_ann, name="ann-build", daemon=True).start()
+
+
+def _run_index_job(job):
+    # the job's stage totals (summed over files and pool workers) are reported with its result
+    with metrics.trace(details=False) as trace, SHARED.exclusive() if SHARED else nullcontext():
+        if SHARED is not None:
+            # start from what the other workers have indexed
+            STORE.reload()
+            SHARED.refresh(INDEX)
+        generation = face_search.load_index_info(STORE, max_side=MAX_DETECT_SIDE)["generation"]
+        summary = face_search.index_folder(IMAGES_DIR, STORE, index=INDEX, workers=INDEX_WORKERS,
+                                           progress=job, thumbs_dir=THUMBS_DIR, thumb_format=THUMB_FORMAT,
+                                           max_side=MAX_DETECT_SIDE)
+        info = face_search.load_index_info(STORE, max_side=MAX_DETECT_SIDE)
+        if SHARED is not None and info["generation"] != generation:
+            with trace.time("publish"):
+                SHARED.publish(INDEX, info["generation"])
+                SHARED.refresh(INDEX)
+        with trace.time("ann"):
+            _refresh_ann()
+    summary["timings_ms"] = trace.timings_ms()
+    return summary
+
+
+# with a shared index, job states live next to it so any worker can answer a status poll
+JOBS = IndexJobQueue(_run_index_job, state_dir=os.path.join(SHARED.root, "jobs") if SHARED else None)
+threading.Thread(target=_refresh_ann, name="ann-build", daemon=True).start()
+CPU = BoundedExecutor(SEARCH_CONCURRENCY, SEARCH_QUEUE, name="search")
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static")
 app.mount("/images", StaticFiles(directory=IMAGES_DIR), name="images")
+app.mount("/thumbs", StaticFiles(directory=THUMBS_DIR), name="thumbs")
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -26,34 +131,234 @@ async def home():
         return HTMLResponse(f.read())
 
 
-@app.post("/api/index")
-async def index_images(files: List[UploadFile] = File(...)):
-    saved = 0
-    for up in files:
-        fname = os.path.basename(up.filename)
-        dest = os.path.join(IMAGES_DIR, fname)
-        with open(dest, "wb") as f:
-            shutil.copyfileobj(up.file, f)
-        saved += 1
-    added = face_search.index_folder(IMAGES_DIR, ENC_PATH)
-    return {"saved_files": saved, "faces_indexed": added}
+@app.exception_handler(ExecutorSaturated)
+async def executor_saturated(request: Request, exc: ExecutorSaturated):
+    return JSONResponse(status_code=503, content={"detail": str(exc)},
+                        headers={"Retry-After": str(exc.retry_after)})
 
 
-@app.post("/api/search")
-async def search_image(file: UploadFile = File(...), top_k: int = Form(5)):
-    data = await file.read()
-    probe = face_search.encode_image_bytes(data)
-    if probe is None:
-        raise HTTPException(status_code=400, detail="No face found in probe image")
-    encs = face_search.load_encodings(ENC_PATH)
-    results = face_search.find_matches(probe, encs, top_k=top_k)
+def _save_uploads(files: List[UploadFile]):
+    saved = duplicates = skipped = 0
+    try:
+        for up in files:
+            if not IMAGES.accepts(up.filename):
+                # the indexer would never read it; storing it as an image would mislabel it
+                skipped += 1
+                continue
+            _, created = IMAGES.save(up.file, up.filename)
+            if created:
+                saved += 1
+            else:
+                duplicates += 1
+    finally:
+        IMAGES.flush()
+    return saved, duplicates, skipped
+
+
+def _traced(trace: metrics.Trace, submitted: float, fn, *args):
+    # runs on a CPU thread: face_search records its stages into the current trace
+    with metrics.trace(trace):
+        trace.add("queue", time.perf_counter() - submitted)
+        return fn(*args)
+
+
+def _timed_json(trace: metrics.Trace, content, debug: bool, status_code: int = 200) -> JSONResponse:
+    """JSONResponse with a Server-Timing header; with debug the trace is also added to the body."""
+    if debug:
+        content["debug"] = {"timings_ms": trace.timings_ms(), **trace.details}
+    with trace.time("serialize"):
+        response = JSONResponse(content, status_code=status_code)
+    response.headers["Server-Timing"] = trace.server_timing()
+    return response
+
+
+def _check_search_params(metric: str, top_k: int, nprobe: Optional[int]):
+    if metric not in face_search.METRICS:
+        raise HTTPException(status_code=400, detail=f"metric must be one of: {', '.join(face_search.METRICS)}")
+    if not 1 <= top_k <= MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {MAX_TOP_K}")
+    if nprobe is not None and nprobe < 0:
+        raise HTTPException(status_code=400, detail="nprobe must be 0 (exact search) or more")
+
+
+def _probe_faces(data: bytes):
+    # decode + detection dominate a search, so a re-submitted photo skips both; the first
+    # face is what encode_image_bytes would return, so every endpoint shares one entry
+    key = PROBES.digest(data)
+    return key, PROBES.probe(key, lambda: face_search.encode_image_faces(data, max_side=MAX_DETECT_SIDE))
+
+
+def _search(data: bytes, top_k: int, nprobe: int, metric: str):
+    _sync_index()
+    key, faces = _probe_faces(data)
+    if not faces:
+        return None
+    probe = faces[0]["encoding"]
+    return PROBES.results(key, ("search", metric, nprobe), top_k, INDEX.generation,
+                          lambda: INDEX.search(probe, top_k=top_k, nprobe=nprobe, metric=metric))
+
+
+def _search_batch(datas: List[bytes], top_k: int, nprobe: int, metric: str):
+    _sync_index()
+    generation, params = INDEX.generation, ("search", metric, nprobe)
+    probes, results = [], []
+    for data in datas:
+        key, faces = _probe_faces(data)
+        probes.append((key, faces[0]["encoding"] if faces else None))
+        results.append(PROBES.lookup(key, params, top_k, generation) if faces else None)
+    # only probes without cached results are scanned, still in a single pass
+    todo = [i for i, (_, p) in enumerate(probes) if p is not None and results[i] is None]
+    if todo:
+        hits = INDEX.search_batch(np.vstack([probes[i][1] for i in todo]), top_k=top_k, nprobe=nprobe, metric=metric)
+        for i, r in zip(todo, hits):
+            PROBES.store(probes[i][0], params, top_k, generation, r)
+            results[i] = r
+    return results
+
+
+def _search_faces(data: bytes, top_k: int, nprobe: int, metric: str):
+    _sync_index()
+    key, faces = _probe_faces(data)
+    if not faces:
+        return None, []
+    probes = np.vstack([f["encoding"] for f in faces])
+    files = PROBES.results(key, ("faces", metric, nprobe), top_k, INDEX.generation,
+                           lambda: INDEX.search_files(probes, top_k=top_k, nprobe=nprobe, metric=metric))
+    return files, [{"face": i, "box": f["box"]} for i, f in enumerate(faces)]
+
+
+def _thumb_url(file: str, face_index: int) -> Optional[str]:
+    # faces indexed before thumbnails existed have none; the client falls back to url
+    name = face_search.thumb_name(file, face_index, THUMB_FORMAT)
+    return f"/thumbs/{name}" if os.path.exists(os.path.join(THUMBS_DIR, name)) else None
+
+
+def _add_urls(results):
     # convert relative paths used in encodings to image URLs for frontend
     for r in results:
-        r["url"] = f"/images/{os.path.basename(r['file'])}"
-    return JSONResponse({"results": results})
+        rel = os.path.relpath(os.path.abspath(r["file"]), IMAGES_DIR).replace(os.sep, "/")
+        r["url"] = f"/images/{rel}"
+        r["thumb_url"] = _thumb_url(r["file"], r["face_index"])
+        r["names"] = IMAGES.names(rel)
+        for hit in r.get("hits", ()):
+            hit["thumb_url"] = _thumb_url(r["file"], hit["face_index"])
+    return results
+
+
+@app.post("/api/index")
+async def index_images(files: List[UploadFile] = File(...), debug: bool = False):
+    """Store the uploads and queue an index job.
+
+    Server-Timing covers storing the files; decode/detect/encode totals of the job are in
+    its result (``timings_ms``) once it is done.
+    """
+    trace = metrics.Trace()
+    with trace.time("upload"):
+        saved, duplicates, skipped = await run_in_threadpool(_save_uploads, files)
+    if not saved:
+        # every upload was already stored byte for byte, or is not an image: nothing to index
+        return _timed_json(trace, {"job_id": None, "status": "done", "saved_files": 0,
+                                   "duplicate_files": duplicates, "skipped_files": skipped}, debug)
+    # files are on disk; encoding happens in the background and is polled via the job URL
+    job = JOBS.submit(saved_files=saved, duplicate_files=duplicates, skipped_files=skipped)
+    return _timed_json(trace, {
+        "job_id": job.id,
+        "status": job.status,
+        "saved_files": saved,
+        "duplicate_files": duplicates,
+        "skipped_files": skipped,
+        "status_url": f"/api/index/jobs/{job.id}",
+    }, debug, status_code=202)
+
+
+@app.get("/api/index/jobs/{job_id}")
+async def index_job_status(job_id: str):
+    state = JOBS.status(job_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Unknown index job")
+    return state
+
+
+@app.post("/api/search")
+async def search_image(file: UploadFile = File(...), top_k: int = Form(5),
+                       nprobe: Optional[int] = Form(None), metric: str = Form("euclidean"),
+                       debug: bool = False):
+    """Top matches for the first face in the probe.
+
+    Every response carries a Server-Timing header (upload, queue, decode, detect, encode,
+    scan, serialize, total; a probe or result served from the cache skips its stages).
+    With ``?debug=1`` the body also gets ``debug``: the same timings plus the probe's
+    dimensions, detector input size and candidate windows, and rows scanned.
+    """
+    _check_search_params(metric, top_k, nprobe)
+    trace = metrics.Trace()
+    with trace.time("upload"):
+        data = await file.read()
+    results = await CPU.run(_traced, trace, time.perf_counter(), _search, data, top_k,
+                            ANN_NPROBE if nprobe is None else nprobe, metric)
+    if results is None:
+        return _timed_json(trace, {"detail": "No face found in probe image"}, debug, status_code=400)
+    return _timed_json(trace, {"results": _add_urls(results), "metric": metric}, debug)
+
+
+@app.post("/api/search/batch")
+async def search_batch(files: List[UploadFile] = File(...), top_k: int = Form(5),
+                       nprobe: Optional[int] = Form(None), metric: str = Form("euclidean"),
+                       debug: bool = False):
+    """Search several photos of the same person in one scan of the index.
+
+    Returns each probe's own matches plus ``results``, the fused ranking where every
+    indexed face keeps its best distance over all probes. Timings and debug as for
+    /api/search, summed over the probes.
+    """
+    _check_search_params(metric, top_k, nprobe)
+    trace = metrics.Trace()
+    with trace.time("upload"):
+        datas = [await f.read() for f in files]
+    per_probe = await CPU.run(_traced, trace, time.perf_counter(), _search_batch, datas, top_k,
+                              ANN_NPROBE if nprobe is None else nprobe, metric)
+    if all(r is None for r in per_probe):
+        return _timed_json(trace, {"detail": "No face found in any probe image"}, debug, status_code=400)
+    probes = []
+    for up, results in zip(files, per_probe):
+        if results is None:
+            probes.append({"file": up.filename, "error": "No face found in probe image"})
+        else:
+            probes.append({"file": up.filename, "results": _add_urls(results)})
+    combined = face_search.combine_results([r or [] for r in per_probe], top_k)
+    return _timed_json(trace, {"results": _add_urls(combined), "probes": probes, "metric": metric}, debug)
+
+
+@app.post("/api/search/faces")
+async def search_faces(file: UploadFile = File(...), top_k: int = Form(5),
+                       nprobe: Optional[int] = Form(None), metric: str = Form("euclidean"),
+                       debug: bool = False):
+    """Search with every face in a group photo at once.
+
+    ``probe_faces`` lists the detected boxes; ``results`` holds the top_k files, each
+    ranked by its best face and tagged with the probe face (index into probe_faces)
+    that matched it. Timings and debug as for /api/search.
+    """
+    _check_search_params(metric, top_k, nprobe)
+    trace = metrics.Trace()
+    with trace.time("upload"):
+        data = await file.read()
+    results, probe_faces = await CPU.run(_traced, trace, time.perf_counter(), _search_faces, data, top_k,
+                                         ANN_NPROBE if nprobe is None else nprobe, metric)
+    if results is None:
+        return _timed_json(trace, {"detail": "No face found in probe image"}, debug, status_code=400)
+    return _timed_json(trace, {"results": _add_urls(results), "probe_faces": probe_faces,
+                               "metric": metric}, debug)
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus text exposition of this worker process's metrics."""
+    return Response(metrics.generate_latest(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.get("/api/status")
 async def status():
-    encs = face_search.load_encodings(ENC_PATH)
-    return {"indexed_faces": len(encs)}
+    """Index metadata record (kept up to date by every index run) and probe cache stats."""
+    info = face_search.load_index_info(STORE, max_side=MAX_DETECT_SIDE)
+    return {"indexed_faces": info["faces"], **info, "probe_cache": PROBES.stats()}
@@ -0,0 +1,326 @@
+"""Per-process Prometheus counters, gauges and histograms, plus per-request stage timings (Trace)."""
+import os
+import sys
+import math
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds; from sub-millisecond histogram/scan steps up to a multi-second full-size decode
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List["_Metric"] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            if any(m.name == metric.name for m in self._metrics):
+                raise ValueError(f"Duplicate metric {metric.name!r}")
+            self._metrics.append(metric)
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return next((m for m in self._metrics if m.name == name), None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Child:
+    """One labelled series of a metric, as returned by ``labels()``."""
+
+    def __init__(self, metric: "_Metric", key: Tuple[str, ...]):
+        self._metric = metric
+        self._key = key
+
+    def inc(self, amount: float = 1.0):
+        self._metric._record(self._key, amount)
+
+    def observe(self, value: float):
+        self._metric._record(self._key, value)
+
+    def set(self, value: float):
+        self._metric._set(self._key, value)
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._metric._record(self._key, time.perf_counter() - start)
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._children: Dict[Tuple[str, ...], _Child] = {}
+        self._unlabelled = _Child(self, ())
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values, **kwargs) -> _Child:
+        key = tuple(str(kwargs[n]) for n in self.labelnames) if kwargs else tuple(map(str, values))
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            child = self._children.setdefault(key, _Child(self, key))
+        return child
+
+    def _record(self, key: Tuple[str, ...], value: float):
+        captured = getattr(_local, "captured", None)
+        if captured is not None:
+            captured.append((self.name, key, value))
+        else:
+            self._apply(key, value)
+
+    def _apply(self, key: Tuple[str, ...], value: float):
+        raise NotImplementedError
+
+    def _set(self, key: Tuple[str, ...], value: float):
+        raise TypeError(f"{self.kind} {self.name} cannot be set")
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def _apply(self, key, value):
+        if value < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        if not items and not self.labelnames:
+            items = [((), 0.0)]
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """A value that goes up and down; set_function makes it computed at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._unlabelled.set(value)
+
+    def set_function(self, fn: Callable[[], float]):
+        self._function = fn
+
+    def _apply(self, key, value):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._values[key] = float(value)
+
+    def samples(self):
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, k)} {_format_value(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional[Registry] = REGISTRY):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def time(self):
+        return self._unlabelled.time()
+
+    def _apply(self, key, value):
+        # per-bucket counts, made cumulative when rendered; the last slot is +Inf
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, (list(counts), total)) for k, (counts, total) in self._values.items())
+        lines = []
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+@contextmanager
+def capture() -> Iterator[List[tuple]]:
+    """Buffer this thread's counter and histogram updates instead of applying them.
+
+    For work done in another process: return the yielded list to the parent and pass it
+    to replay() there.
+    """
+    outer = getattr(_local, "captured", None)
+    _local.captured = observed = []
+    try:
+        yield observed
+    finally:
+        _local.captured = outer
+
+
+def replay(observed: List[tuple], registry: Registry = REGISTRY):
+    for name, key, value in observed:
+        metric = registry.get(name)
+        if metric is not None:
+            metric._record(key, value)
+
+
+class Trace:
+    """Stage durations (seconds, summed per stage in first-seen order) and debug details of one request.
+
+    details are only kept when asked for; an index run would otherwise keep one entry
+    per file.
+    """
+
+    def __init__(self, details: bool = True):
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.details: Optional[Dict[str, List[Any]]] = {} if details else None
+
+    def add(self, name: str, seconds: float):
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def merge(self, timings: Dict[str, float]):
+        for name, seconds in timings.items():
+            self.add(name, seconds)
+
+    def note(self, key: str, value: Any):
+        if self.details is not None:
+            self.details.setdefault(key, []).append(value)
+
+    @contextmanager
+    def time(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def timings_ms(self) -> Dict[str, float]:
+        return {name: round(seconds * 1000, 3) for name, seconds in self.timings.items()}
+
+    def server_timing(self) -> str:
+        """Server-Timing header value, e.g. ``decode;dur=41.2, detect;dur=350.8, total;dur=402.5``.
+
+        total is the time since the trace was created; stages may overlap or leave gaps.
+        """
+        entries = [*self.timings.items(), ("total", time.perf_counter() - self.started)]
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in entries)
+
+
+@contextmanager
+def trace(existing: Optional[Trace] = None, details: bool = True) -> Iterator[Trace]:
+    """Make a Trace (a new one, or existing) current on this thread; see current_trace()."""
+    outer = getattr(_local, "trace", None)
+    _local.trace = current = existing if existing is not None else Trace(details)
+    try:
+        yield current
+    finally:
+        _local.trace = outer
+
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, "trace", None)
+
+
+def note(key: str, value: Any):
+    """Record a debug detail on the current trace, if any."""
+    current = getattr(_local, "trace", None)
+    if current is not None:
+        current.note(key, value)
+
+
+def resident_memory_bytes() -> float:
+    """Current RSS of this process (peak RSS where /proc is unavailable, NaN on Windows)."""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        return math.nan
+
+
+Gauge("process_resident_memory_bytes", "Resident memory size in bytes").set_function(resident_memory_bytes)
+
+
+def generate_latest(registry: Registry = REGISTRY) -> bytes:
+    return registry.render().encode("utf-8")
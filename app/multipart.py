@@ -0,0 +1,206 @@
+"""Streaming multipart/form-data parser that writes file parts straight to temporary files."""
+import os
+import re
+import hashlib
+import tempfile
+from typing import Callable, Dict, List, Optional, Tuple, BinaryIO
+
+CHUNK_SIZE = 1 << 16
+MAX_FILE_SIZE = 100 << 20
+MAX_TOTAL_SIZE = 4 << 30
+MAX_FIELD_SIZE = 64 << 10
+MAX_HEADER_SIZE = 16 << 10
+
+_PARAM_RE = re.compile(r';\s*([\w*-]+)=("(?:[^"\\]|\\.)*"|[^;]*)')
+
+
+class MultipartError(ValueError):
+    """Malformed request body; the handler should answer ``status``."""
+
+    status = 400
+
+
+class UploadTooLarge(MultipartError):
+    status = 413
+
+
+class UploadedFile:
+    """A file part written to disk: ``path`` belongs to the caller once handed over."""
+
+    def __init__(self, field: str, filename: str, path: str, size: int, sha256: str,
+                 content_type: str = ""):
+        self.field = field
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.content_type = content_type
+
+
+def parse_boundary(content_type: str) -> bytes:
+    if not content_type.lower().startswith("multipart/form-data"):
+        raise MultipartError("Expected multipart/form-data")
+    params = _header_params(content_type)
+    boundary = params.get("boundary", "")
+    if not boundary or len(boundary) > 70:
+        raise MultipartError("Missing or invalid multipart boundary")
+    return boundary.encode("latin-1")
+
+
+def _header_params(value: str) -> Dict[str, str]:
+    params = {}
+    for key, val in _PARAM_RE.findall(value):
+        if val.startswith('"'):
+            val = re.sub(r'\\(.)', r'\1', val[1:-1])
+        params[key.lower()] = val.strip()
+    return params
+
+
+def _part_headers(raw: bytes) -> Tuple[Dict[str, str], str]:
+    headers = {}
+    for line in raw.decode("utf-8", "replace").split("\r\n"):
+        name, sep, value = line.partition(":")
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    disposition = headers.get("content-disposition", "")
+    if not disposition.lower().startswith("form-data"):
+        raise MultipartError("Part without form-data Content-Disposition")
+    return _header_params(disposition), headers.get("content-type", "")
+
+
+class _Body:
+    """Reads at most length bytes from rfile, chunk by chunk."""
+
+    def __init__(self, rfile: BinaryIO, length: int, chunk_size: int):
+        self.rfile = rfile
+        self.remaining = length
+        self.chunk_size = chunk_size
+
+    def read(self) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        chunk = self.rfile.read(min(self.chunk_size, self.remaining))
+        if not chunk:
+            raise MultipartError("Request body ended early")
+        self.remaining -= len(chunk)
+        return chunk
+
+
+def parse_multipart(rfile: BinaryIO, content_type: str, content_length: int, dest_dir: str,
+                    on_file: Optional[Callable[[UploadedFile], None]] = None,
+                    max_file_size: int = MAX_FILE_SIZE, max_total_size: int = MAX_TOTAL_SIZE,
+                    max_field_size: int = MAX_FIELD_SIZE,
+                    chunk_size: int = CHUNK_SIZE) -> Tuple[Dict[str, str], List[UploadedFile]]:
+    """Parse a multipart/form-data body of content_length bytes from rfile.
+
+    Returns (fields, files). Each file part is streamed into dest_dir and passed to
+    on_file as soon as its closing boundary is read, so work such as indexing can start
+    while later parts are still arriving. Parts with an empty filename (an unused file
+    input) are skipped. Raises UploadTooLarge past max_file_size / max_total_size and
+    MultipartError on malformed input, after removing every temporary file that was not
+    handed to on_file.
+    """
+    files: List[UploadedFile] = []
+    try:
+        return _parse(rfile, content_type, content_length, dest_dir, files, on_file,
+                      max_file_size, max_total_size, max_field_size, chunk_size)
+    except BaseException:
+        if on_file is None:
+            for upload in files:
+                os.remove(upload.path)
+        raise
+
+
+def _parse(rfile, content_type, content_length, dest_dir, files, on_file,
+           max_file_size, max_total_size, max_field_size, chunk_size):
+    boundary = parse_boundary(content_type)
+    if content_length > max_total_size:
+        raise UploadTooLarge(f"Upload exceeds {max_total_size} bytes")
+    body = _Body(rfile, content_length, chunk_size)
+    # the leading CRLF lets the first boundary match the same delimiter as the others
+    delimiter = b"\r\n--" + boundary
+    keep = len(delimiter) + 1
+    buf = b"\r\n"
+    fields: Dict[str, str] = {}
+
+    def fill() -> bool:
+        nonlocal buf
+        chunk = body.read()
+        buf += chunk
+        return bool(chunk)
+
+    # preamble
+    while True:
+        idx = buf.find(delimiter)
+        if idx >= 0:
+            buf = buf[idx + len(delimiter):]
+            break
+        buf = buf[-keep:]
+        if not fill():
+            raise MultipartError("Multipart boundary not found")
+
+    while True:
+        while len(buf) < 2 and fill():
+            pass
+        if buf.startswith(b"--"):
+            # the closing CRLF and any epilogue must not be left for the next keep-alive request
+            while body.read():
+                pass
+            return fields, files
+        if not buf.startswith(b"\r\n"):
+            raise MultipartError("Malformed multipart boundary line")
+        buf = buf[2:]
+
+        while True:
+            end = buf.find(b"\r\n\r\n")
+            if end >= 0:
+                break
+            if len(buf) > MAX_HEADER_SIZE:
+                raise MultipartError("Multipart part headers too large")
+            if not fill():
+                raise MultipartError("Request body ended inside part headers")
+        params, part_type = _part_headers(buf[:end])
+        buf = buf[end + 4:]
+        field = params.get("name", "")
+        filename = params.get("filename")
+
+        sink, size, digest, tmp_path = None, 0, None, None
+        value = bytearray()
+        if filename:
+            fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=dest_dir)
+            sink, digest = os.fdopen(fd, "wb"), hashlib.sha256()
+        try:
+            while True:
+                idx = buf.find(delimiter)
+                data = buf[:idx] if idx >= 0 else buf[:-keep]
+                if data:
+                    size += len(data)
+                    if filename:
+                        if size > max_file_size:
+                            raise UploadTooLarge(f"{os.path.basename(filename)} exceeds {max_file_size} bytes")
+                        sink.write(data)
+                        digest.update(data)
+                    elif filename is None:
+                        if size > max_field_size:
+                            raise UploadTooLarge(f"Form field {field!r} exceeds {max_field_size} bytes")
+                        value += data
+                if idx >= 0:
+                    buf = buf[idx + len(delimiter):]
+                    break
+                buf = buf[len(data):]
+                if not fill():
+                    raise MultipartError("Request body ended inside a part")
+        except BaseException:
+            if sink is not None:
+                sink.close()
+                os.remove(tmp_path)
+            raise
+
+        if filename:
+            sink.close()
+            upload = UploadedFile(field, filename, tmp_path, size, digest.hexdigest(), part_type)
+            files.append(upload)
+            if on_file is not None:
+                on_file(upload)
+        elif filename is None:
+            fields[field] = value.decode("utf-8", "replace")
@@ -0,0 +1,122 @@
+"""One search index memory-mapped by several server processes (uvicorn --workers N)."""
+import os
+import json
+import shutil
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from .face_search import FaceIndex
+from .fileio import write_atomic
+from .store import EncodingStore
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single process is all this can coordinate
+    fcntl = None
+
+POINTER = "CURRENT"
+LAYOUT = "layout.json"
+
+
+class SharedIndexFiles:
+    """Index snapshots under root, one folder of .npy columns per published generation.
+
+    root holds CURRENT (name of the live snapshot, replaced atomically), lock (flock'd
+    by the process indexing or publishing) and gen-<generation>-<id>/ folders. Workers
+    remap when CURRENT moves on; the previous snapshot is kept for those that have not.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._pointer = os.path.join(root, POINTER)
+        self._lock = threading.Lock()
+        # flock also excludes other threads of this process, except where fcntl is missing
+        self._writer = threading.Lock()
+        # (inode, mtime) of CURRENT when last checked, and the snapshot it named
+        self._seen: Optional[Tuple[int, int]] = None
+        self._mapped: Optional[str] = None
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """Hold the cross-process writer lock, e.g. around an index run and its publish."""
+        with self._writer, open(os.path.join(self.root, "lock"), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def current(self) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Name and layout of the live snapshot, or None if none has been published."""
+        try:
+            with open(self._pointer, "r", encoding="utf-8") as f:
+                name = f.read().strip()
+            with open(os.path.join(self.root, name, LAYOUT), "r", encoding="utf-8") as f:
+                return name, json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, index: FaceIndex, generation: int) -> str:
+        """Write index as the snapshot of generation and make it the live one.
+
+        generation is the index metadata record's (see face_search.load_index_info), so
+        a worker starting later can tell whether the snapshot matches the store. Call
+        with exclusive() held.
+        """
+        name = "gen-%06d-%s" % (generation, uuid.uuid4().hex[:8])
+        tmp = os.path.join(self.root, name + ".tmp")
+        os.makedirs(tmp)
+        layout = dict(index.save_columns(tmp), generation=generation)
+        write_atomic(os.path.join(tmp, LAYOUT), json.dumps(layout).encode("utf-8"))
+        os.replace(tmp, os.path.join(self.root, name))
+        previous = self.current()
+        write_atomic(self._pointer, name.encode("utf-8"))
+        keep = {name, previous[0] if previous else None}
+        for entry in os.listdir(self.root):
+            if entry.startswith("gen-") and entry not in keep:
+                shutil.rmtree(os.path.join(self.root, entry), ignore_errors=True)
+        return name
+
+    def refresh(self, index: FaceIndex) -> bool:
+        """Map the live snapshot into index if it changed since the last call; True if it did.
+
+        Costs one stat when nothing changed, so it can run before every search.
+        """
+        try:
+            st = os.stat(self._pointer)
+        except OSError:
+            return False
+        seen = (st.st_ino, st.st_mtime_ns)
+        if seen == self._seen:
+            return False
+        with self._lock:
+            if seen == self._seen:
+                return False
+            found = self.current()
+            if found is None:
+                # CURRENT moved on again while it was being read; the next call retries
+                return False
+            name, layout = found
+            remapped = name != self._mapped
+            if remapped:
+                index.map_columns(os.path.join(self.root, name), layout)
+                self._mapped = name
+            self._seen = seen
+        return remapped
+
+    def open(self, store: EncodingStore, generation: int, precision: str = "float32") -> FaceIndex:
+        """FaceIndex mapped from the live snapshot, publishing one first if it is missing or stale."""
+        index = FaceIndex(store.dim, precision, store)
+        with self.exclusive():
+            found = self.current()
+            layout = found[1] if found else None
+            if (layout is None or layout["generation"] != generation
+                    or layout["precision"] != precision or layout["dim"] != store.dim):
+                self.publish(FaceIndex.from_store(store, precision=precision), generation)
+            self.refresh(index)
+        return index
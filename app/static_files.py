@@ -0,0 +1,129 @@
+"""Static file responses with conditional and range requests, sent with socket.sendfile."""
+import os
+import mimetypes
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler
+from typing import Optional, Tuple
+
+
+def content_type(path: str) -> str:
+    ctype, _ = mimetypes.guess_type(path)
+    return ctype or "application/octet-stream"
+
+
+def make_etag(st: os.stat_result) -> str:
+    # a replaced file gets a new mtime (and usually size), so the tag changes with it
+    return '"%x-%x"' % (st.st_mtime_ns, st.st_size)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    tags = [t.strip() for t in header.split(",")]
+    return any(t[2:] == etag if t.startswith("W/") else t == etag for t in tags)
+
+
+def _not_modified_since(header: str, mtime: float) -> bool:
+    try:
+        since = parsedate_to_datetime(header)
+    except (TypeError, ValueError, IndexError):
+        return False
+    return since is not None and int(mtime) <= since.timestamp()
+
+
+def is_fresh(headers, etag: str, mtime: float) -> bool:
+    """True if the client's cached copy is current; If-None-Match wins over If-Modified-Since."""
+    if "If-None-Match" in headers:
+        return _etag_matches(headers["If-None-Match"], etag)
+    if "If-Modified-Since" in headers:
+        return _not_modified_since(headers["If-Modified-Since"], mtime)
+    return False
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a Range header into an inclusive (start, end) byte range.
+
+    Returns None when the whole file should be sent (no header, a unit other than bytes,
+    malformed syntax or several ranges, all of which a server may ignore) and raises
+    ValueError when the range cannot be satisfied.
+    """
+    unit, _, spec = (header or "").partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep or not (first + last).isdigit():
+        return None
+    if not first:
+        # suffix range: the last n bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+def send_file(handler: BaseHTTPRequestHandler, path: str, max_age: int = 0, head: bool = False) -> int:
+    """Answer the current request with the file at path and return the status code sent.
+
+    max_age is the Cache-Control freshness lifetime in seconds. With the default 0 clients
+    and proxies keep the file but revalidate it on every use, which costs a 304 without a
+    body; raise it only for files that are never replaced under the same URL.
+    """
+    try:
+        f = open(path, "rb")
+    except OSError:
+        handler.send_response(404)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
+        return 404
+    with f:
+        st = os.fstat(f.fileno())
+        etag = make_etag(st)
+        validators = [
+            ("ETag", etag),
+            ("Last-Modified", formatdate(st.st_mtime, usegmt=True)),
+            ("Cache-Control", f"public, max-age={max_age}" if max_age else "public, no-cache"),
+        ]
+        if is_fresh(handler.headers, etag, st.st_mtime):
+            handler.send_response(304)
+            for name, value in validators:
+                handler.send_header(name, value)
+            handler.end_headers()
+            return 304
+
+        size = st.st_size
+        status, start, end = 200, 0, size - 1
+        if_range = handler.headers.get("If-Range")
+        # If-Range: honour Range only while the client's copy is still the current one
+        if "Range" in handler.headers and (if_range is None or if_range.strip() == etag):
+            try:
+                byte_range = parse_range(handler.headers["Range"], size)
+            except ValueError:
+                handler.send_response(416)
+                handler.send_header("Content-Range", f"bytes */{size}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return 416
+            if byte_range is not None:
+                status, (start, end) = 206, byte_range
+
+        count = end - start + 1
+        handler.send_response(status)
+        handler.send_header("Content-Type", content_type(path))
+        handler.send_header("Content-Length", str(count))
+        handler.send_header("Accept-Ranges", "bytes")
+        if status == 206:
+            handler.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        for name, value in validators:
+            handler.send_header(name, value)
+        handler.end_headers()
+        if not head and count > 0:
+            handler.wfile.flush()
+            handler.connection.sendfile(f, offset=start, count=count)
+        return status
@@ -0,0 +1,156 @@
+import os
+import json
+import threading
+from typing import List, Dict, Any, Optional, Iterator, Tuple
+import numpy as np
+
+from .fileio import atomic_file, write_atomic
+
+CATALOG = "store.json"
+
+
+class EncodingStore:
+    """Append-only, memory-mappable columnar store for face encodings.
+
+    Layout of the store directory::
+
+        store.json              catalog: dim, segment list, deleted rows per segment
+        seg-000001.npy          float32 (rows, dim) matrix, opened with np.load(mmap_mode="r")
+        seg-000001.meta.json    {"file": [...], "face_index": [...]} parallel to the matrix
+
+    Every ``append`` writes a new segment and never touches existing ones; deletions only
+    record row numbers in the catalog. The catalog is replaced atomically, so a segment
+    becomes visible only once it is fully written.
+    """
+
+    def __init__(self, root: str, dim: int):
+        self.root = root
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._catalog = {"version": 1, "dim": dim, "next_segment": 1, "segments": []}
+        self._meta: Dict[str, Dict[str, list]] = {}
+
+    @classmethod
+    def open(cls, root: str, dim: int, legacy_path: Optional[str] = None) -> "EncodingStore":
+        """Open (or create) the store at root, migrating a legacy encodings.pkl on first use."""
+        os.makedirs(root, exist_ok=True)
+        store = cls(root, dim)
+        catalog_path = os.path.join(root, CATALOG)
+        if os.path.exists(catalog_path):
+            with open(catalog_path, "r", encoding="utf-8") as f:
+                store._catalog = json.load(f)
+            store.dim = store._catalog["dim"]
+        elif legacy_path and os.path.exists(legacy_path):
+            store._migrate(legacy_path)
+        return store
+
+    def reload(self):
+        """Re-read the catalog, picking up segments appended or deleted by another process."""
+        catalog_path = os.path.join(self.root, CATALOG)
+        with self._lock:
+            if os.path.exists(catalog_path):
+                with open(catalog_path, "r", encoding="utf-8") as f:
+                    self._catalog = json.load(f)
+
+    def _migrate(self, legacy_path: str):
+        import pickle
+        with open(legacy_path, "rb") as f:
+            encodings = pickle.load(f)
+        self.append([e for e in encodings if np.size(e["encoding"]) == self.dim])
+        self._save_catalog()
+
+    def _path(self, name: str, suffix: str) -> str:
+        return os.path.join(self.root, name + suffix)
+
+    def _save_catalog(self):
+        write_atomic(os.path.join(self.root, CATALOG), json.dumps(self._catalog).encode("utf-8"))
+
+    def _segment_meta(self, name: str) -> Dict[str, list]:
+        meta = self._meta.get(name)
+        if meta is None:
+            with open(self._path(name, ".meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self._meta[name] = meta
+        return meta
+
+    def __len__(self) -> int:
+        return sum(seg["rows"] - len(seg["deleted"]) for seg in self._catalog["segments"])
+
+    def append(self, encodings: List[Dict[str, Any]]) -> Optional[str]:
+        """Write encodings as a new segment and return its name."""
+        if not encodings:
+            return None
+        vectors = np.asarray([np.ravel(e["encoding"]) for e in encodings], dtype=np.float32)
+        meta = {
+            "file": [e["file"] for e in encodings],
+            "face_index": [int(e.get("face_index", 0)) for e in encodings],
+        }
+        with self._lock:
+            name = "seg-%06d" % self._catalog["next_segment"]
+            with atomic_file(self._path(name, ".npy")) as f:
+                np.save(f, vectors)
+            write_atomic(self._path(name, ".meta.json"), json.dumps(meta).encode("utf-8"))
+            self._meta[name] = meta
+            self._catalog["next_segment"] += 1
+            self._catalog["segments"].append({"name": name, "rows": len(vectors), "deleted": []})
+            self._save_catalog()
+        return name
+
+    def delete_files(self, files) -> int:
+        """Mark every row belonging to files as deleted; returns the number of rows removed."""
+        files = set(files)
+        if not files:
+            return 0
+        removed = 0
+        with self._lock:
+            live = []
+            for seg in self._catalog["segments"]:
+                deleted = set(seg["deleted"])
+                for row, fname in enumerate(self._segment_meta(seg["name"])["file"]):
+                    if fname in files and row not in deleted:
+                        deleted.add(row)
+                        removed += 1
+                seg["deleted"] = sorted(deleted)
+                if len(deleted) < seg["rows"]:
+                    live.append(seg)
+            dropped = [seg["name"] for seg in self._catalog["segments"] if seg not in live]
+            self._catalog["segments"] = live
+            if removed:
+                self._save_catalog()
+            for name in dropped:
+                self._meta.pop(name, None)
+                for suffix in (".npy", ".meta.json"):
+                    try:
+                        os.remove(self._path(name, suffix))
+                    except OSError:
+                        pass
+        return removed
+
+    def vectors(self, name: str) -> np.ndarray:
+        """Full float32 matrix of segment name as a read-only memory map, deleted rows included."""
+        return np.load(self._path(name, ".npy"), mmap_mode="r")
+
+    def live_rows(self) -> Iterator[Tuple[str, np.ndarray]]:
+        """Yield (segment name, row numbers of its live rows), in the order of segments()."""
+        for seg in list(self._catalog["segments"]):
+            keep = np.ones(seg["rows"], dtype=bool)
+            keep[seg["deleted"]] = False
+            yield seg["name"], np.flatnonzero(keep)
+
+    def segments(self) -> Iterator[Tuple[np.ndarray, List[str], List[int]]]:
+        """Yield (vectors, files, face_indices) for the live rows of every segment.
+
+        Segments without deletions are returned as read-only memory maps (zero-copy).
+        """
+        for seg in list(self._catalog["segments"]):
+            vectors = self.vectors(seg["name"])
+            meta = self._segment_meta(seg["name"])
+            files, face_indices = meta["file"], meta["face_index"]
+            if seg["deleted"]:
+                keep = np.ones(seg["rows"], dtype=bool)
+                keep[seg["deleted"]] = False
+                rows = np.flatnonzero(keep)
+                vectors = vectors[keep]
+                files = [files[i] for i in rows]
+                face_indices = [face_indices[i] for i in rows]
+            yield vectors, files, face_indices
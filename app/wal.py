@@ -0,0 +1,98 @@
+"""Write-ahead log for a single-file pickled index such as data/encodings.pkl."""
+import os
+import zlib
+import pickle
+import struct
+import threading
+from typing import Any, List
+
+from .fileio import atomic_file, fsync_dir
+
+# each record: 4-byte big-endian payload length, CRC-32 of the payload, pickled payload
+_HEADER = struct.Struct(">II")
+
+
+def wal_path_for(index_path: str) -> str:
+    """Log path for a single-file index such as data/encodings.pkl."""
+    return os.path.splitext(index_path)[0] + ".wal"
+
+
+def write_checkpoint(obj: Any, path: str):
+    """Pickle obj to path, atomically and durably."""
+    with atomic_file(path) as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class WriteAheadLog:
+    """Records appended and fsync'd one at a time, read back with replay() after a restart.
+
+    A crash between a checkpoint and reset() replays records the checkpoint already
+    holds, so applying a record must be idempotent.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def replay(self) -> List[Any]:
+        """Every complete record in the log, oldest first; a torn tail is truncated away."""
+        records, good = [], 0
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return records
+        with f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                records.append(pickle.loads(payload))
+                good = f.tell()
+            torn = good < os.fstat(f.fileno()).st_size
+        if torn:
+            with open(self.path, "r+b") as f:
+                f.truncate(good)
+                os.fsync(f.fileno())
+        return records
+
+    def append(self, record: Any) -> int:
+        """Durably append one record and return the size of the log in bytes."""
+        payload = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._file is None:
+                created = not os.path.exists(self.path)
+                self._file = open(self.path, "ab")
+                if created:
+                    fsync_dir(os.path.dirname(self.path))
+            self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            return self._file.tell()
+
+    @property
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def reset(self):
+        """Empty the log, once a checkpoint holds everything in it."""
+        with self._lock:
+            self._close()
+            with open(self.path, "wb") as f:
+                os.fsync(f.fileno())
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
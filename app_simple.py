@@ -4,98 +4,170 @@ Minimal Missing Person Finder - Simple HTTP Server (no uvicorn needed)
 Run with: python app_simple.py
 """
 import os
-import sys
 import json
 import pickle
-from typing import List, Dict, Any, Optional
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from urllib.parse import urljoin, urlparse
-import io
+import tempfile
+import threading
+from typing import List, Dict, Any, Iterable, Optional
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote, parse_qs
 import numpy as np
-from PIL import Image
 import cv2
 
+# Face detection and encoding are shared with the FastAPI app
+from app.face_search import (encode_image_bytes, _extract_faces, FaceIndex, thumb_name,
+                              write_thumbnails, remove_thumbnails, ENCODER_VERSION,
+                              stage, IMAGES_INDEXED, FACES_DETECTED, ERRORS, INDEX_FACES,
+                              INDEX_BYTES)
+from app import metrics
+from app.index_info import info_path_for, read_info, write_info
+from app.multipart import parse_multipart, MultipartError
+from app.cache import ProbeCache
+from app.concurrency import ReadWriteLock
+from app.static_files import send_file
+from app.wal import WriteAheadLog, wal_path_for, write_checkpoint
+
 # Paths
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
 IMAGES_DIR = os.path.join(DATA_DIR, "images")
+THUMBS_DIR = os.path.join(DATA_DIR, "thumbs")
 ENC_PATH = os.path.join(DATA_DIR, "encodings.pkl")
+# face/file counts etc. rewritten with every save, so /api/status never unpickles the index
+INFO_PATH = info_path_for(ENC_PATH)
+# uploads are streamed to disk; these cap a single file and a whole request body
+MAX_FILE_BYTES = 100 * 1024 * 1024
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024 * 1024
+# encodings and results of recently searched photos; results are dropped when the index changes
+PROBE_CACHE_BYTES = 64 * 1024 * 1024
+# largest top_k a search may ask for
+MAX_TOP_K = 100
+# uploads are logged to data/encodings.wal in fsync'd batches of this many files; the
+# pickle is only rewritten once the log outgrows CHECKPOINT_BYTES (and on shutdown)
+INDEX_BATCH_FILES = 16
+CHECKPOINT_BYTES = 64 * 1024 * 1024
 os.makedirs(IMAGES_DIR, exist_ok=True)
+os.makedirs(THUMBS_DIR, exist_ok=True)
 
 # Simple face search functions (from app/face_search.py)
+@stage("load")
 def load_encodings(path: str) -> List[Dict[str, Any]]:
     if not os.path.exists(path):
         return []
     with open(path, "rb") as f:
         return pickle.load(f)
 
-def save_encodings(encodings: List[Dict[str, Any]], path: str):
-    with open(path, "wb") as f:
-        pickle.dump(encodings, f)
-
-def image_bytes_to_array(file_bytes: bytes):
-    image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
-    return cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-
-def _extract_face_encodings(image_cv) -> List[np.ndarray]:
-    encodings = []
-    gray = cv2.cvtColor(image_cv, cv2.COLOR_BGR2GRAY)
-    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-    faces = cascade.detectMultiScale(gray, 1.1, 4)
-    for (x, y, w, h) in faces:
-        face_img = image_cv[y:y+h, x:x+w]
-        if face_img.size == 0:
-            continue
-        hist = cv2.calcHist([face_img], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
-        hist = cv2.normalize(hist, hist).flatten()
-        encodings.append(hist)
-    return encodings
-
-def index_folder(folder: str, encodings_path: str) -> int:
-    os.makedirs(folder, exist_ok=True)
-    encodings = load_encodings(encodings_path)
-    added = 0
-    for root, _, files in os.walk(folder):
-        for fname in files:
-            if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
-                continue
-            fpath = os.path.join(root, fname)
-            try:
-                img = cv2.imread(fpath)
-                if img is None:
-                    continue
-                face_encs = _extract_face_encodings(img)
-                for i, enc in enumerate(face_encs):
-                    item = {"file": os.path.relpath(fpath), "face_index": i, "encoding": enc}
-                    encodings.append(item)
-                    added += 1
-            except Exception:
-                continue
-    save_encodings(encodings, encodings_path)
-    return added
-
-def encode_image_bytes(file_bytes: bytes) -> Optional[np.ndarray]:
+def save_info(encodings: List[Dict[str, Any]], path: str, bump: bool = True) -> Dict[str, Any]:
+    """Rewrite the metadata record of the encodings file at path (bytes include its log)."""
+    nbytes = sum(os.path.getsize(p) for p in (path, wal_path_for(path)) if os.path.exists(p))
+    return write_info(info_path_for(path), faces=len(encodings), files=len({e["file"] for e in encodings}),
+                      encoder=ENCODER_VERSION, nbytes=nbytes, bump=bump)
+
+def encode_file(fpath: str) -> List[Dict[str, Any]]:
+    """Encoding entries for every face in fpath ([] if it cannot be decoded).
+
+    A thumbnail of each face is written to THUMBS_DIR on the way.
+    """
+    rel = os.path.relpath(fpath)
+    try:
+        with stage("decode"):
+            img = cv2.imread(fpath)
+        faces = _extract_faces(img) if img is not None else []
+    except Exception:
+        img, faces = None, []
+    if img is None:
+        ERRORS.labels(source="index").inc()
+    else:
+        IMAGES_INDEXED.inc()
+        FACES_DETECTED.labels(source="index").inc(len(faces))
+    # also drops crops left over from a previous version of the file with more faces
+    remove_thumbnails(THUMBS_DIR, rel, keep=len(faces))
     try:
-        arr = image_bytes_to_array(file_bytes)
-        embeds = _extract_face_encodings(arr)
-        if len(embeds) == 0:
-            return None
-        return embeds[0]
+        write_thumbnails(img, faces, 1.0, THUMBS_DIR, rel)
     except Exception:
-        return None
+        pass  # the results page falls back to the full image
+    return [{"file": rel, "face_index": i, "encoding": enc} for i, (_, enc) in enumerate(faces)]
 
-def find_matches(encoding: np.ndarray, encodings: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
-    if len(encodings) == 0:
-        return []
-    all_encs = np.vstack([np.array(e["encoding"]) for e in encodings])
-    diffs = all_encs - encoding
-    dists = np.linalg.norm(diffs, axis=1)
-    idx = np.argsort(dists)[:top_k]
-    results = []
-    for i in idx:
-        e = encodings[int(i)]
-        results.append({"file": e["file"], "face_index": e.get("face_index", 0), "distance": float(dists[int(i)])})
-    return results
+class SharedIndex:
+    """encodings.pkl loaded once per process and searched by every request thread.
+
+    Searches hold the read lock, so they run concurrently (NumPy releases the GIL for
+    the distance computation); an index update encodes its files without any lock and
+    only takes the write lock to swap the new rows in.
+
+    Updates are appended to a write-ahead log (see app.wal) before they are applied,
+    and the pickle is rewritten only when the log exceeds checkpoint_bytes; updates
+    logged since the last checkpoint are replayed on startup.
+    """
+
+    def __init__(self, path: str, checkpoint_bytes: int = CHECKPOINT_BYTES):
+        self.path = path
+        self.checkpoint_bytes = checkpoint_bytes
+        self._rw = ReadWriteLock()
+        # one update at a time, so each one starts from the previous one's result
+        self._update_lock = threading.Lock()
+        self._encodings = load_encodings(path)
+        self._log = WriteAheadLog(wal_path_for(path))
+        records = self._log.replay()
+        for record in records:
+            # a record may already be in the pickle if a checkpoint was cut short; applying
+            # it again gives the same rows
+            self._encodings = _replace_files(self._encodings, record["files"], record["items"])
+        self._index = FaceIndex.from_encodings(self._encodings)
+        if records:
+            self.checkpoint()
+        elif not os.path.exists(info_path_for(path)):
+            save_info(self._encodings, path, bump=False)
+
+    def __len__(self) -> int:
+        with self._rw.read():
+            return len(self._encodings)
+
+    @property
+    def generation(self) -> int:
+        return self._index.generation
+
+    @property
+    def nbytes(self) -> int:
+        return self._index.nbytes
+
+    def search(self, probe: np.ndarray, top_k: int) -> List[Dict[str, Any]]:
+        with self._rw.read():
+            return self._index.search(probe, top_k)
+
+    def replace_files(self, files: Iterable[str], items: List[Dict[str, Any]]):
+        """Drop every face of files (relative paths) and add items; durable on return."""
+        files = set(files)
+        with self._update_lock:
+            log_bytes = self._log.append({"files": sorted(files), "items": items})
+            encodings = _replace_files(self._encodings, files, items)
+            with self._rw.write():
+                self._encodings = encodings
+                self._index.update(items, removed_files=files)
+            if log_bytes >= self.checkpoint_bytes:
+                self._checkpoint()
+            else:
+                save_info(encodings, self.path)
+
+    def checkpoint(self):
+        """Rewrite the pickle with every logged update and empty the log."""
+        with self._update_lock:
+            self._checkpoint()
+
+    def _checkpoint(self):
+        write_checkpoint(self._encodings, self.path)
+        self._log.reset()
+        save_info(self._encodings, self.path)
+
+
+def _replace_files(encodings: List[Dict[str, Any]], files: Iterable[str],
+                   items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    files = set(files)
+    return [e for e in encodings if e["file"] not in files] + items
+
+# opened under __main__, so importing this module (e.g. from the tests) leaves data/ alone
+INDEX: Optional[SharedIndex] = None
+PROBES = ProbeCache(PROBE_CACHE_BYTES)
 
 # HTML Page
 HTML_PAGE = """<!doctype html>
@@ -116,6 +188,7 @@ HTML_PAGE = """<!doctype html>
       .match{display:inline-block;margin:10px;text-align:center;background:#fff;padding:10px;border:1px solid #ddd;border-radius:4px}
       .match img{max-width:150px;max-height:150px;display:block;margin-bottom:10px;border-radius:4px}
       .match div{font-size:12px;color:#666}
+      .timing{margin-top:6px;font-size:12px;color:#888}
     </style>
   </head>
   <body>
@@ -154,6 +227,17 @@ HTML_PAGE = """<!doctype html>
         document.getElementById('status').innerHTML = 'Status: offline';
       });
 
+      // Server-Timing "decode;dur=41.2, detect;dur=350.8" -> "decode 41 ms · detect 351 ms"
+      function timingText(res) {
+        const header = res.headers.get('Server-Timing');
+        if (!header) return '';
+        return header.split(',').map(entry => {
+          const [name, ...params] = entry.trim().split(';');
+          const dur = params.find(p => p.trim().startsWith('dur='));
+          return dur ? `${name} ${Math.round(parseFloat(dur.trim().slice(4)))} ms` : name;
+        }).join(' · ');
+      }
+
       document.getElementById('indexBtn').onclick = async () => {
         const files = document.getElementById('indexFiles').files;
         if (!files.length) return alert('Choose image files to index');
@@ -163,7 +247,8 @@ HTML_PAGE = """<!doctype html>
         try {
           const res = await fetch('/api/index', {method:'POST', body:fd});
           const j = await res.json();
-          document.getElementById('indexResult').innerHTML = `✅ Saved <b>${j.saved_files}</b> files, indexed <b>${j.faces_indexed}</b> faces`;
+          document.getElementById('indexResult').innerHTML = `✅ Saved <b>${j.saved_files}</b> files, indexed <b>${j.faces_indexed}</b> faces`
+            + `<div class="timing">${timingText(res)}</div>`;
           fetch('/api/status').then(r => r.json()).then(d => {
             document.getElementById('status').innerHTML = `Faces indexed: <b>${d.indexed_faces}</b>`;
           });
@@ -182,30 +267,47 @@ HTML_PAGE = """<!doctype html>
         fd.append('top_k', topk);
         try {
           const res = await fetch('/api/search', {method:'POST', body:fd});
+          const timing = document.createElement('div');
+          timing.className = 'timing';
+          timing.innerText = timingText(res);
           if (!res.ok) {
             const t = await res.json();
-            return document.getElementById('searchResult').innerHTML = '❌ ' + (t.detail || 'Unknown error');
+            document.getElementById('searchResult').innerHTML = '❌ ' + (t.detail || 'Unknown error');
+            return document.getElementById('searchResult').appendChild(timing);
           }
           const j = await res.json();
           const el = document.getElementById('searchResult');
           el.innerHTML = '';
           if (!j.results.length) {
             el.innerText = 'No matches found';
-            return;
+            return el.appendChild(timing);
           }
           el.innerHTML = '<h4>Top ' + j.results.length + ' matches:</h4>';
           for (let r of j.results) {
             const d = document.createElement('div');
             d.className = 'match';
             const img = document.createElement('img');
-            img.src = r.url;
-            img.onerror = () => img.src = 'data:image/svg+xml,%3Csvg xmlns="http://www.w3.org/2000/svg" width="150" height="150"%3E%3Crect fill="%23ccc" width="150" height="150"/%3E%3Ctext x="50%25" y="50%25" dominant-baseline="middle" text-anchor="middle" font-family="Arial" font-size="14" fill="%23999"%3EImage not found%3C/text%3E%3C/svg%3E';
+            // the face crop is a few KB; fall back to the full photo if it is missing
+            img.src = r.thumb_url || r.url;
+            img.onerror = () => {
+              if (r.thumb_url && !img.dataset.full) {
+                img.dataset.full = '1';
+                img.src = r.url;
+              } else {
+                img.src = 'data:image/svg+xml,%3Csvg xmlns="http://www.w3.org/2000/svg" width="150" height="150"%3E%3Crect fill="%23ccc" width="150" height="150"/%3E%3Ctext x="50%25" y="50%25" dominant-baseline="middle" text-anchor="middle" font-family="Arial" font-size="14" fill="%23999"%3EImage not found%3C/text%3E%3C/svg%3E';
+              }
+            };
             const p = document.createElement('div');
             p.innerHTML = `Distance: <b>${r.distance.toFixed(4)}</b><br/><small>${r.file}</small>`;
-            d.appendChild(img);
+            const link = document.createElement('a');
+            link.href = r.url;
+            link.target = '_blank';
+            link.appendChild(img);
+            d.appendChild(link);
             d.appendChild(p);
             el.appendChild(d);
           }
+          el.appendChild(timing);
         } catch(e) {
           document.getElementById('searchResult').innerHTML = '❌ ' + e.message;
         }
@@ -217,139 +319,182 @@ HTML_PAGE = """<!doctype html>
 
 # HTTP Request Handler
 class RequestHandler(BaseHTTPRequestHandler):
+    # keep-alive: every response carries Content-Length; idle connections close after 30s
+    protocol_version = "HTTP/1.1"
+    timeout = 30
+
+    def _send_empty(self, status: int):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
     def do_GET(self):
         if self.path == "/" or self.path == "/index.html":
+            body = HTML_PAGE.encode("utf-8")
             self.send_response(200)
             self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(HTML_PAGE.encode("utf-8"))
-        elif self.path.startswith("/images/"):
-            fname = self.path.split("/")[-1]
-            fpath = os.path.join(IMAGES_DIR, fname)
-            if os.path.exists(fpath):
-                try:
-                    with open(fpath, "rb") as f:
-                        self.send_response(200)
-                        self.send_header("Content-Type", "image/jpeg")
-                        self.end_headers()
-                        self.wfile.write(f.read())
-                except:
-                    self.send_response(500)
-                    self.end_headers()
-            else:
-                self.send_response(404)
-                self.end_headers()
-        elif self.path == "/api/status":
-            encs = load_encodings(ENC_PATH)
+            self.wfile.write(body)
+        elif self.path.startswith(("/images/", "/thumbs/")):
+            self._send_image()
+        elif self.path == "/metrics":
+            body = metrics.generate_latest()
             self.send_response(200)
-            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Type", metrics.CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
             self.end_headers()
-            self.wfile.write(json.dumps({"indexed_faces": len(encs)}).encode())
+            self.wfile.write(body)
+        elif self.path == "/api/status":
+            info = read_info(INFO_PATH)
+            self._send_json(200, {"indexed_faces": info["faces"], **info, "probe_cache": PROBES.stats()})
         else:
-            self.send_response(404)
-            self.end_headers()
+            self._send_empty(404)
+
+    def do_HEAD(self):
+        if self.path.startswith(("/images/", "/thumbs/")):
+            self._send_image(head=True)
+        else:
+            self._send_empty(404)
+
+    def _send_image(self, head: bool = False):
+        path = unquote(urlparse(self.path).path)
+        if path.startswith("/thumbs/"):
+            # thumbnails are sharded as <2 hex>/<name>; anything else is refused
+            shard, _, fname = path[len("/thumbs/"):].partition("/")
+            if len(shard) != 2 or not shard.isalnum() or "/" in fname or fname.startswith("."):
+                self._send_empty(404)
+                return
+            send_file(self, os.path.join(THUMBS_DIR, shard, fname), head=head)
+        else:
+            send_file(self, os.path.join(IMAGES_DIR, os.path.basename(path)), head=head)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], trace: Optional[metrics.Trace] = None,
+                   debug: bool = False):
+        """Send payload; with a trace, add a Server-Timing header (and, with debug, the trace itself)."""
+        if trace is None:
+            body = json.dumps(payload).encode()
+        else:
+            if debug:
+                payload["debug"] = {"timings_ms": trace.timings_ms(), **trace.details}
+            with trace.time("serialize"):
+                body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if trace is not None:
+            self.send_header("Server-Timing", trace.server_timing())
+        self.end_headers()
+        self.wfile.write(body)
 
     def do_POST(self):
-        content_length = int(self.headers.get("Content-Length", 0))
-        body = self.rfile.read(content_length)
+        url = urlparse(self.path)
+        if url.path not in ("/api/index", "/api/search"):
+            self.close_connection = True
+            self._send_empty(404)
+            return
+        if "Content-Length" not in self.headers:
+            # whatever body the client sent is unread
+            self.close_connection = True
+            self._send_json(411, {"detail": "Content-Length required"})
+            return
+        # ?debug=1 adds the request's timings, image sizes and candidate counts to the response
+        debug = parse_qs(url.query).get("debug", ["0"])[-1] not in ("", "0", "false")
+        try:
+            length = int(self.headers["Content-Length"])
+            # stages timed in app.face_search on this thread are collected for Server-Timing
+            with metrics.trace() as trace:
+                if url.path == "/api/index":
+                    self._handle_index(length, trace, debug)
+                else:
+                    self._handle_search(length, trace, debug)
+        except MultipartError as e:
+            # the rest of the body is unread, so the connection cannot be reused
+            self.close_connection = True
+            self._send_json(e.status, {"detail": str(e)})
+        except Exception as e:
+            self.close_connection = True
+            self._send_json(500, {"error": str(e)})
 
-        if self.path == "/api/index":
-            try:
-                # Parse multipart form data (simple version)
-                import re
-                files_data = []
-                # Extract filename and binary data from multipart
-                parts = body.split(b"--")
-                for part in parts:
-                    if b"filename=" in part:
-                        try:
-                            fn_match = re.search(b'filename="([^"]+)"', part)
-                            if fn_match:
-                                fname = fn_match.group(1).decode()
-                                # Find the binary data after \r\n\r\n
-                                split_idx = part.find(b"\r\n\r\n")
-                                if split_idx > 0:
-                                    data = part[split_idx+4:-2]  # Remove \r\n at end
-                                    if data:
-                                        fpath = os.path.join(IMAGES_DIR, os.path.basename(fname))
-                                        with open(fpath, "wb") as f:
-                                            f.write(data)
-                                        files_data.append(fname)
-                        except:
-                            pass
-
-                saved = len(files_data)
-                added = index_folder(IMAGES_DIR, ENC_PATH)
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"saved_files": saved, "faces_indexed": added}).encode())
-            except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": str(e)}).encode())
-
-        elif self.path == "/api/search":
+    def _handle_index(self, length: int, trace: metrics.Trace, debug: bool = False):
+        # each file is moved into place and encoded as soon as its part has been received;
+        # every INDEX_BATCH_FILES files are logged and swapped into the index, so a
+        # dropped connection or a crash loses at most the batch in progress
+        batch_files, batch_items = [], []
+        saved = indexed = 0
+
+        def flush():
+            nonlocal saved, indexed
+            if batch_files:
+                with trace.time("save"):
+                    INDEX.replace_files(batch_files, batch_items)
+                saved, indexed = saved + len(batch_files), indexed + len(batch_items)
+                batch_files.clear()
+                batch_items.clear()
+
+        def on_file(upload):
+            fpath = os.path.join(IMAGES_DIR, os.path.basename(upload.filename))
+            os.replace(upload.path, fpath)
+            batch_files.append(os.path.relpath(fpath))
+            batch_items.extend(encode_file(fpath))
+            if len(batch_files) >= INDEX_BATCH_FILES:
+                flush()
+
+        try:
+            parse_multipart(self.rfile, self.headers.get("Content-Type", ""), length, IMAGES_DIR,
+                            on_file=on_file, max_file_size=MAX_FILE_BYTES, max_total_size=MAX_UPLOAD_BYTES)
+        finally:
+            flush()
+        self._send_json(200, {"saved_files": saved, "faces_indexed": indexed}, trace, debug)
+
+    def _handle_search(self, length: int, trace: metrics.Trace, debug: bool = False):
+        with trace.time("upload"):
+            fields, files = parse_multipart(self.rfile, self.headers.get("Content-Type", ""), length,
+                                            tempfile.gettempdir(), max_file_size=MAX_FILE_BYTES,
+                                            max_total_size=MAX_FILE_BYTES + 64 * 1024)
+            file_data = None
             try:
-                # Extract file from multipart
-                import re
-                file_data = None
-                top_k = 5
-
-                parts = body.split(b"--")
-                for part in parts:
-                    if b'name="file"' in part and b"Content-Disposition" in part:
-                        split_idx = part.find(b"\r\n\r\n")
-                        if split_idx > 0:
-                            file_data = part[split_idx+4:-2]
-                    elif b'name="top_k"' in part:
-                        split_idx = part.find(b"\r\n\r\n")
-                        if split_idx > 0:
-                            try:
-                                top_k = int(part[split_idx+4:-2].decode().strip())
-                            except:
-                                pass
-
-                if not file_data:
-                    self.send_response(400)
-                    self.send_header("Content-Type", "application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"detail": "No file provided"}).encode())
-                    return
-
-                probe = encode_image_bytes(file_data)
-                if probe is None:
-                    self.send_response(400)
-                    self.send_header("Content-Type", "application/json")
-                    self.end_headers()
-                    self.wfile.write(json.dumps({"detail": "No face found in probe image"}).encode())
-                    return
-
-                encs = load_encodings(ENC_PATH)
-                results = find_matches(probe, encs, top_k=top_k)
-                for r in results:
-                    r["url"] = f"/images/{os.path.basename(r['file'])}"
-
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"results": results}).encode())
-            except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": str(e)}).encode())
-        else:
-            self.send_response(404)
-            self.end_headers()
+                probe_file = next((f for f in files if f.field == "file"), None)
+                if probe_file is not None:
+                    with open(probe_file.path, "rb") as f:
+                        file_data = f.read()
+            finally:
+                for upload in files:
+                    os.remove(upload.path)
+        try:
+            top_k = int(fields.get("top_k", 5))
+        except ValueError:
+            top_k = 5
+
+        if not file_data:
+            self._send_json(400, {"detail": "No file provided"}, trace, debug)
+            return
+        if not 1 <= top_k <= MAX_TOP_K:
+            self._send_json(400, {"detail": f"top_k must be between 1 and {MAX_TOP_K}"}, trace, debug)
+            return
+
+        # re-submitting the same photo (e.g. to change top_k) skips decode, detection and the scan
+        key = PROBES.digest(file_data)
+        probe = PROBES.probe(key, lambda: encode_image_bytes(file_data))
+        if probe is None:
+            self._send_json(400, {"detail": "No face found in probe image"}, trace, debug)
+            return
+
+        results = PROBES.results(key, ("search",), top_k, INDEX.generation, lambda: INDEX.search(probe, top_k))
+        for r in results:
+            r["url"] = f"/images/{os.path.basename(r['file'])}"
+            r["thumb_url"] = f"/thumbs/{thumb_name(r['file'], r['face_index'])}"
+        self._send_json(200, {"results": results}, trace, debug)
 
     def log_message(self, format, *args):
         # Suppress default logging
         pass
 
 if __name__ == "__main__":
-    server = HTTPServer(("127.0.0.1", 8000), RequestHandler)
+    INDEX = SharedIndex(ENC_PATH)
+    INDEX_FACES.set_function(lambda: len(INDEX))
+    INDEX_BYTES.set_function(lambda: INDEX.nbytes)
+    server = ThreadingHTTPServer(("127.0.0.1", 8000), RequestHandler)
     print("🚀 Missing Person Finder running at http://127.0.0.1:8000")
     print("   - Index event images at /")
     print("   - Search for missing person face")
@@ -357,4 +502,5 @@ if __name__ == "__main__":
     try:
         server.serve_forever()
     except KeyboardInterrupt:
+        INDEX.checkpoint()
         print("\n✋ Server stopped.")
@@ -0,0 +1 @@
+"""Reproducible performance benchmarks. Run modules with ``python -m benchmarks.<name>``."""
@@ -0,0 +1,69 @@
+"""
+Exact vs approximate (IVF / IVF-PQ) search: recall@k and per-query latency.
+
+    python -m benchmarks.bench_ann --faces 200000 --nprobe 1 4 16 64 --pq-m 0 32
+
+Recall is the fraction of the exact top-k that the ANN search also returns. Use the
+report to pick ANN_NPROBE / ANN_PQ_M for a deployment.
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.face_search import FaceIndex
+from benchmarks.synthetic import make_encodings
+
+
+def _index(vectors: np.ndarray) -> FaceIndex:
+    index = FaceIndex(vectors.shape[1])
+    index.update([{"file": str(i), "face_index": 0, "encoding": v} for i, v in enumerate(vectors)])
+    return index
+
+
+def _timed(index: FaceIndex, queries: np.ndarray, top_k: int, nprobe):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        results.append({r["file"] for r in index.search(q, top_k, nprobe=nprobe)})
+        latencies.append(time.perf_counter() - start)
+    ms = np.array(latencies) * 1000
+    return results, {"p50_ms": round(float(np.percentile(ms, 50)), 3),
+                     "p95_ms": round(float(np.percentile(ms, 95)), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--pq-m", type=int, nargs="+", default=[0, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = make_encodings(args.faces, seed=args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.02 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    index = _index(vectors)
+    truth, exact = _timed(index, queries, args.top_k, None)
+    report = {"faces": args.faces, "queries": args.queries, "top_k": args.top_k, "exact": exact, "ann": []}
+    for pq_m in args.pq_m:
+        start = time.perf_counter()
+        ann = index.build_ann(nlist=args.nlist, pq_m=pq_m)
+        build_sec = time.perf_counter() - start
+        for nprobe in args.nprobe:
+            found, latency = _timed(index, queries, args.top_k, nprobe)
+            recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+            report["ann"].append({"nlist": ann.nlist, "pq_m": pq_m, "nprobe": nprobe,
+                                  "build_sec": round(build_sec, 2), "recall": round(float(recall), 4),
+                                  **latency})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Indexing throughput on high-resolution photos: full-resolution decode + detection versus
+reduced JPEG decoding with detection capped at --max-side pixels.
+
+    python -m benchmarks.bench_decode --images 20 --width 6000 --height 4000 --max-side 1600
+
+Faces found in both runs are compared by box overlap (boxes are reported at full
+resolution either way) and by the Euclidean distance between their encodings.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from app import face_search
+from benchmarks.synthetic import make_corpus
+
+
+def _run(paths, max_side: int):
+    start = time.perf_counter()
+    faces = []
+    for p in paths:
+        img, scale = face_search.load_image(p, max_side)
+        faces.append(face_search._extract_faces(img, max_side=max_side, scale=scale))
+    elapsed = time.perf_counter() - start
+    stats = {"images": len(paths), "faces": sum(map(len, faces)), "seconds": round(elapsed, 3),
+             "images_per_sec": round(len(paths) / elapsed, 2)}
+    return faces, stats
+
+
+def _iou(a, b) -> float:
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    iw = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    ih = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = iw * ih
+    return inter / float(aw * ah + bw * bh - inter)
+
+
+def _agreement(full, reduced) -> dict:
+    matched, distances = 0, []
+    for faces_a, faces_b in zip(full, reduced):
+        for box, enc in faces_a:
+            best = max(faces_b, key=lambda f: _iou(box, f[0]), default=None)
+            if best is not None and _iou(box, best[0]) >= 0.5:
+                matched += 1
+                distances.append(float(np.linalg.norm(enc - best[1])))
+    total = sum(map(len, full))
+    return {"faces_matched": matched, "match_rate": round(matched / total, 4) if total else 0.0,
+            "mean_encoding_distance": round(float(np.mean(distances)), 4) if distances else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--max-side", type=int, nargs="+", default=[2400, 1600, 1000])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = make_corpus(tmp, args.images, args.width, args.height)
+        full, base = _run(paths, 0)
+        report = {"full_resolution": base, "reduced": []}
+        for max_side in args.max_side:
+            reduced, stats = _run(paths, max_side)
+            stats.update(max_side=max_side, speedup=round(stats["images_per_sec"] / base["images_per_sec"], 2),
+                         **_agreement(full, reduced))
+            report["reduced"].append(stats)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Indexing throughput with a Haar cascade constructed per image (the old behaviour)
+versus the per-thread cached detector in app.face_search.
+
+    python -m benchmarks.bench_detector --images 200
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import cv2
+
+from app import face_search
+from benchmarks.synthetic import make_corpus
+
+
+def _encode_with_fresh_cascade(img):
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    cascade = cv2.CascadeClassifier(face_search.CASCADE_PATH)
+    faces = cascade.detectMultiScale(gray, 1.1, 4)
+    return [cv2.calcHist([img[y:y+h, x:x+w]], [0, 1, 2], None, [8, 8, 8], [0, 256, 0, 256, 0, 256])
+            for (x, y, w, h) in faces]
+
+
+def _run(images, encode) -> dict:
+    start = time.perf_counter()
+    faces = sum(len(encode(img)) for img in images)
+    elapsed = time.perf_counter() - start
+    return {"images": len(images), "faces": faces, "seconds": round(elapsed, 3),
+            "images_per_sec": round(len(images) / elapsed, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # decode up front so both runs measure detection + encoding only
+        images = [cv2.imread(p) for p in make_corpus(tmp, args.images, args.width, args.height)]
+    report = {
+        "per_image_cascade": _run(images, _encode_with_fresh_cascade),
+        "cached_detector": _run(images, face_search._extract_face_encodings),
+    }
+    report["speedup"] = round(report["cached_detector"]["images_per_sec"]
+                              / report["per_image_cascade"]["images_per_sec"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
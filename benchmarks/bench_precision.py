@@ -0,0 +1,68 @@
+"""
+Compact index precisions (float16 / uint8 codes + float32 re-score from disk) against the
+float32 index: resident memory per face, recall@k and per-query latency.
+
+    python -m benchmarks.bench_precision --faces 200000 --metric euclidean chi_square
+
+Recall is the fraction of the float32 exact top-k that the compact index also returns.
+"""
+import argparse
+import json
+import tempfile
+import time
+
+import numpy as np
+
+from app.face_search import FaceIndex, PRECISIONS
+from app.store import EncodingStore
+from benchmarks.synthetic import make_encodings
+
+
+def _timed(index: FaceIndex, queries: np.ndarray, top_k: int, metric: str, rerank: int):
+    latencies, results = [], []
+    for q in queries:
+        start = time.perf_counter()
+        hits = index.search_batch(q[None], top_k, rerank=rerank, metric=metric)[0]
+        latencies.append(time.perf_counter() - start)
+        results.append({(r["file"], r["face_index"]) for r in hits})
+    ms = np.array(latencies) * 1000
+    return results, {"p50_ms": round(float(np.percentile(ms, 50)), 3),
+                     "p95_ms": round(float(np.percentile(ms, 95)), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faces", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--metric", nargs="+", default=["euclidean"])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors = make_encodings(args.faces, seed=args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = vectors[rng.choice(len(vectors), args.queries, replace=False)]
+    queries = queries + 0.02 * rng.standard_normal(queries.shape, dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as root:
+        store = EncodingStore.open(root, vectors.shape[1])
+        store.append([{"file": str(i), "face_index": 0, "encoding": v} for i, v in enumerate(vectors)])
+        indexes = {p: FaceIndex.from_store(store, precision=p) for p in PRECISIONS}
+        report = {"faces": args.faces, "queries": args.queries, "top_k": args.top_k,
+                  "bytes_per_face": {p: round(ix.nbytes / len(ix), 1) for p, ix in indexes.items()},
+                  "runs": []}
+        for metric in args.metric:
+            truth, exact = _timed(indexes["float32"], queries, args.top_k, metric, 1)
+            report["runs"].append({"metric": metric, "precision": "float32", "recall": 1.0, **exact})
+            for precision in PRECISIONS[1:]:
+                for rerank in args.rerank:
+                    found, latency = _timed(indexes[precision], queries, args.top_k, metric, rerank)
+                    recall = np.mean([len(f & t) / len(t) for f, t in zip(found, truth)])
+                    report["runs"].append({"metric": metric, "precision": precision, "rerank": rerank,
+                                           "recall": round(float(recall), 4), **latency})
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+End-to-end regression suite: indexing throughput on a synthetic photo corpus, then search
+latency and memory per face on synthetic encoding matrices of increasing size.
+
+    python -m benchmarks.bench_suite --images 200 --faces 10000 100000 1000000 --output bench.json
+    python -m benchmarks.bench_suite --faces 100000 --baseline bench.json
+
+The report (stdout, and --output if given) records the commit and library versions next to
+the numbers. With --baseline, each metric also gets its ratio to the same metric in an
+earlier report: above 1 means faster (images/sec) or slower / larger (latency, bytes).
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from app import face_search
+from app.face_search import FaceIndex
+from app.metrics import resident_memory_bytes
+from app.store import EncodingStore
+from benchmarks.synthetic import make_corpus, make_encodings
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(), "numpy": np.__version__, "opencv": cv2.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def _private_memory() -> float:
+    """Anonymous resident memory (Linux), else RSS: page cache behind the store's memmaps
+    would otherwise count as if the index held it."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("RssAnon:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resident_memory_bytes()
+
+
+def bench_index(images: int, width: int, height: int, workers: int, max_side: int, seed: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "images")
+        make_corpus(folder, images, width, height, seed=seed)
+        store = face_search.open_store(os.path.join(tmp, "index"))
+        start = time.perf_counter()
+        summary = face_search.index_folder(folder, store, workers=workers, max_side=max_side)
+        elapsed = time.perf_counter() - start
+    return {"images": images, "width": width, "height": height, "workers": workers, "max_side": max_side,
+            "faces": summary["faces_added"], "errors": len(summary["errors"]), "seconds": round(elapsed, 3),
+            "images_per_sec": round(images / elapsed, 2), "faces_per_sec": round(summary["faces_added"] / elapsed, 2)}
+
+
+def bench_search(faces: int, queries: int, top_k: int, metric: str, precision: str, seed: int) -> dict:
+    vectors = make_encodings(faces, seed=seed)
+    rng = np.random.default_rng(seed + 1)
+    probes = vectors[rng.choice(faces, queries, replace=False)]
+    probes = probes + 0.02 * rng.standard_normal(probes.shape, dtype=np.float32)
+    with tempfile.TemporaryDirectory() as root:
+        store = EncodingStore.open(root, vectors.shape[1])
+        store.append([{"file": f"synthetic_{i:07d}.jpg", "face_index": 0, "encoding": v}
+                      for i, v in enumerate(vectors)])
+        del vectors
+        gc.collect()
+        rss_before = _private_memory()
+        start = time.perf_counter()
+        index = FaceIndex.from_store(store, precision=precision)
+        load_sec = time.perf_counter() - start
+        index.search(probes[0], top_k, metric=metric)
+        latencies = []
+        for q in probes:
+            start = time.perf_counter()
+            index.search(q, top_k, metric=metric)
+            latencies.append(time.perf_counter() - start)
+        rss_per_face = (_private_memory() - rss_before) / faces
+        index_bytes = index.nbytes
+        del index
+    ms = np.array(latencies) * 1000
+    return {"faces": faces, "queries": queries, "top_k": top_k, "metric": metric, "precision": precision,
+            "load_sec": round(load_sec, 3),
+            **{f"p{p}_ms": round(float(np.percentile(ms, p)), 3) for p in (50, 95, 99)},
+            "queries_per_sec": round(len(ms) / (ms.sum() / 1000), 1),
+            "index_bytes_per_face": round(index_bytes / faces, 1),
+            "rss_bytes_per_face": None if np.isnan(rss_per_face) else round(float(rss_per_face), 1)}
+
+
+_HIGHER_IS_BETTER = {"images_per_sec", "faces_per_sec", "queries_per_sec"}
+_COMPARED = _HIGHER_IS_BETTER | {"p50_ms", "p95_ms", "p99_ms", "load_sec",
+                                 "index_bytes_per_face", "rss_bytes_per_face"}
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Ratio of every compared metric to the baseline run with the same parameters."""
+    def keyed(runs, params):
+        return {tuple(r.get(p) for p in params): r for r in runs}
+
+    out = {"baseline_commit": baseline.get("environment", {}).get("commit"), "index": [], "search": []}
+    for section, params in (("index", ("images", "width", "height", "workers", "max_side")),
+                            ("search", ("faces", "top_k", "metric", "precision"))):
+        old = keyed(baseline.get(section, []), params)
+        for run in report[section]:
+            ref = old.get(tuple(run.get(p) for p in params))
+            if ref is None:
+                continue
+            ratios = {m: round(run[m] / ref[m], 3) for m in _COMPARED
+                      if run.get(m) is not None and ref.get(m)}
+            out[section].append({**{p: run[p] for p in params}, "ratio": ratios})
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=200, help="corpus size for the index run (0 skips it)")
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=960)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-side", type=int, default=0)
+    parser.add_argument("--faces", type=int, nargs="*", default=[10_000, 100_000])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--metric", default="euclidean", choices=face_search.METRICS)
+    parser.add_argument("--precision", nargs="+", default=["float32"], choices=face_search.PRECISIONS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    report = {"environment": _environment(), "index": [], "search": []}
+    if args.images:
+        report["index"].append(bench_index(args.images, args.width, args.height, args.workers,
+                                           args.max_side, args.seed))
+    for faces in args.faces:
+        for precision in args.precision:
+            report["search"].append(bench_search(faces, min(args.queries, faces), args.top_k, args.metric,
+                                                 precision, args.seed))
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["comparison"] = compare(report, json.load(f))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,25 @@ Run with: python run_demo.py
 """
 import os
 import json
+import tempfile
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, unquote
+
+# stdlib-only streaming parser: uploads go to disk chunk by chunk, never whole into RAM
+from app.multipart import parse_multipart, MultipartError
+# stdlib-only static files: sendfile, ETag / Last-Modified revalidation and Range requests
+from app.static_files import send_file
+# stdlib-only metadata record, so /api/status does not unpickle the index
+from app.index_info import info_path_for, read_info, write_info
 
 BASE_DIR = os.path.dirname(__file__)
 DATA_DIR = os.path.join(BASE_DIR, "data")
 IMAGES_DIR = os.path.join(DATA_DIR, "images")
+MAX_FILE_BYTES = 100 * 1024 * 1024
+MAX_UPLOAD_BYTES = 4 * 1024 * 1024 * 1024
+ENC_PATH = os.path.join(DATA_DIR, "encodings.pkl")
+INFO_PATH = info_path_for(ENC_PATH)
+ENCODER_VERSION = "pil-rgb-hist-768/1"
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
 HTML_PAGE = """<!doctype html>
@@ -159,6 +173,35 @@ HTML_PAGE = """<!doctype html>
 </html>
 """
 
+def _save_info(encodings, bump=True):
+    return write_info(INFO_PATH, faces=len(encodings), files=len({e["file"] for e in encodings}),
+                      encoder=ENCODER_VERSION, nbytes=os.path.getsize(ENC_PATH), bump=bump)
+
+
+def _index_info():
+    if os.path.isfile(INFO_PATH) or not os.path.isfile(ENC_PATH):
+        return read_info(INFO_PATH)
+    # an index written before the record existed: count it once
+    import pickle
+    try:
+        with open(ENC_PATH, "rb") as f:
+            encs = pickle.load(f)
+    except:
+        return read_info(INFO_PATH)
+    return _save_info(encs if isinstance(encs, list) else [], bump=False)
+
+
+def _histogram(fpath):
+    """768-value PIL colour histogram of a 64x64 thumbnail, or None if unreadable."""
+    from PIL import Image
+    try:
+        with Image.open(fpath) as img:
+            # Simple histogram: resize, convert to RGB, extract color histogram
+            return img.resize((64, 64)).convert("RGB").histogram()  # 256*3 = 768 values
+    except:
+        return None
+
+
 class Handler(BaseHTTPRequestHandler):
     def do_GET(self):
         try:
@@ -168,38 +211,14 @@ class Handler(BaseHTTPRequestHandler):
                 self.end_headers()
                 self.wfile.write(HTML_PAGE.encode())
             elif self.path.startswith("/images/"):
-                fname = os.path.basename(self.path)
-                fpath = os.path.join(IMAGES_DIR, fname)
-                if os.path.isfile(fpath):
-                    try:
-                        with open(fpath, "rb") as f:
-                            self.send_response(200)
-                            ext = fname.lower().split('.')[-1]
-                            ctype = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png"}.get(ext, "image/jpeg")
-                            self.send_header("Content-Type", ctype)
-                            self.end_headers()
-                            self.wfile.write(f.read())
-                    except:
-                        self.send_response(500)
-                        self.end_headers()
-                else:
-                    self.send_response(404)
-                    self.end_headers()
+                fname = os.path.basename(unquote(urlparse(self.path).path))
+                send_file(self, os.path.join(IMAGES_DIR, fname))
             elif self.path == "/api/status":
-                import pickle
-                encs_file = os.path.join(DATA_DIR, "encodings.pkl")
-                count = 0
-                if os.path.isfile(encs_file):
-                    try:
-                        with open(encs_file, "rb") as f:
-                            encs = pickle.load(f)
-                            count = len(encs) if isinstance(encs, list) else 0
-                    except:
-                        count = 0
+                info = _index_info()
                 self.send_response(200)
                 self.send_header("Content-Type", "application/json")
                 self.end_headers()
-                self.wfile.write(json.dumps({"indexed_faces": count}).encode())
+                self.wfile.write(json.dumps({"indexed_faces": info["faces"], **info}).encode())
             else:
                 self.send_response(404)
                 self.end_headers()
@@ -212,20 +231,33 @@ class Handler(BaseHTTPRequestHandler):
             except:
                 pass
 
+    def do_HEAD(self):
+        if self.path.startswith("/images/"):
+            fname = os.path.basename(unquote(urlparse(self.path).path))
+            send_file(self, os.path.join(IMAGES_DIR, fname), head=True)
+        else:
+            self.send_response(404)
+            self.end_headers()
+
     def do_POST(self):
         try:
             content_length = int(self.headers.get("Content-Length", 0))
-            body = self.rfile.read(content_length)
 
             if self.path == "/api/index":
-                self._handle_index(body)
+                self._handle_index(content_length)
             elif self.path == "/api/search":
-                self._handle_search(body)
+                self._handle_search(content_length)
             else:
                 self.send_response(404)
                 self.end_headers()
         except ConnectionAbortedError:
             pass  # Client disconnected
+        except MultipartError as e:
+            self.close_connection = True
+            self.send_response(e.status)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(json.dumps({"detail": str(e)}).encode())
         except Exception as e:
             try:
                 self.send_response(500)
@@ -235,66 +267,11 @@ class Handler(BaseHTTPRequestHandler):
             except:
                 pass
 
-    def _handle_index(self, body):
+    def _handle_index(self, content_length):
         try:
-            import re
             from PIL import Image
             import pickle
-            import io
-
-            saved = 0
-            # Parse multipart form data - extract boundary correctly
-            content_type = self.headers.get("Content-Type", "")
-            boundary_match = re.search(r'boundary=([^\r\n;]+)', content_type)
-            if not boundary_match:
-                self.send_response(400)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "Invalid form data"}).encode())
-                return
-            
-            boundary = boundary_match.group(1).strip('"').encode()
-            parts = body.split(b"--" + boundary)
-            
-            for part in parts:
-                if b'filename=' in part:
-                    # Extract filename with flexible quotes
-                    filename_match = re.search(rb'filename=(["\']?)([^"\'\r\n]+)\1', part)
-                    if filename_match:
-                        fname = filename_match.group(2).decode()
-                        # Find the double CRLF that separates headers from body
-                        sep_idx = part.find(b"\r\n\r\n")
-                        if sep_idx < 0:
-                            sep_idx = part.find(b"\n\n")
-                            if sep_idx < 0:
-                                continue
-                            sep_idx += 2
-                            data = part[sep_idx:]
-                        else:
-                            sep_idx += 4
-                            data = part[sep_idx:]
-                        
-                        # Remove trailing boundary markers
-                        if data.endswith(b"\r\n"):
-                            data = data[:-2]
-                        elif data.endswith(b"\n"):
-                            data = data[:-1]
-                        
-                        if data:
-                            # Validate it's a real image
-                            try:
-                                img = Image.open(io.BytesIO(data))
-                                img.load()  # Load to validate
-                            except:
-                                continue
-                            
-                            # Save the file
-                            fpath = os.path.join(IMAGES_DIR, os.path.basename(fname))
-                            with open(fpath, "wb") as f:
-                                f.write(data)
-                            saved += 1
 
-            # Index faces using PIL-based histogram (no numpy/cv2 needed)
             encodings = []
             encs_file = os.path.join(DATA_DIR, "encodings.pkl")
             if os.path.isfile(encs_file):
@@ -304,75 +281,81 @@ class Handler(BaseHTTPRequestHandler):
                 except:
                     encodings = []
 
+            saved = 0
             added = 0
+
+            def on_file(upload):
+                # called as soon as each file part has been written to disk
+                nonlocal saved, added
+                try:
+                    with Image.open(upload.path) as img:
+                        img.verify()  # Validate it's a real image
+                except:
+                    os.remove(upload.path)
+                    return
+                fname = os.path.basename(upload.filename)
+                os.replace(upload.path, os.path.join(IMAGES_DIR, fname))
+                saved += 1
+                encodings[:] = [e for e in encodings if e["file"] != fname]
+                hist = _histogram(os.path.join(IMAGES_DIR, fname))
+                if hist is not None:
+                    encodings.append({"file": fname, "face_index": 0, "encoding": hist})
+                    added += 1
+
+            parse_multipart(self.rfile, self.headers.get("Content-Type", ""), content_length, IMAGES_DIR,
+                            on_file=on_file, max_file_size=MAX_FILE_BYTES, max_total_size=MAX_UPLOAD_BYTES)
+
+            # Index faces using PIL-based histogram (no numpy/cv2 needed)
             indexed_files = {e["file"] for e in encodings}  # Track already indexed
             for fname in os.listdir(IMAGES_DIR):
                 if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
                     continue
                 if fname in indexed_files:  # Skip already indexed
                     continue
-                fpath = os.path.join(IMAGES_DIR, fname)
-                try:
-                    img = Image.open(fpath)
-                    # Simple histogram: resize, convert to RGB, extract color histogram
-                    img = img.resize((64, 64)).convert("RGB")
-                    hist = img.histogram()  # PIL histogram: 256*3 = 768 values
+                hist = _histogram(os.path.join(IMAGES_DIR, fname))
+                if hist is not None:
                     encodings.append({"file": fname, "face_index": 0, "encoding": hist})
                     added += 1
-                except:
-                    pass
 
             with open(encs_file, "wb") as f:
                 pickle.dump(encodings, f)
+            _save_info(encodings)
 
             self.send_response(200)
             self.send_header("Content-Type", "application/json")
             self.end_headers()
             self.wfile.write(json.dumps({"saved_files": saved, "faces_indexed": added}).encode())
+        except MultipartError:
+            raise
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
             self.end_headers()
             self.wfile.write(json.dumps({"error": str(e)}).encode())
 
-    def _handle_search(self, body):
+    def _handle_search(self, content_length):
         try:
-            import re
             import pickle
             from PIL import Image
             import io
 
-            # Parse multipart form data
-            content_type = self.headers.get("Content-Type", "")
-            boundary_match = re.search(r'boundary=([^\r\n;]+)', content_type)
-            if not boundary_match:
-                self.send_response(400)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps({"detail": "Invalid form data"}).encode())
-                return
-            
-            boundary = boundary_match.group(1).strip('"').encode()
-            
+            fields, files = parse_multipart(self.rfile, self.headers.get("Content-Type", ""), content_length,
+                                            tempfile.gettempdir(), max_file_size=MAX_FILE_BYTES,
+                                            max_total_size=MAX_FILE_BYTES + 64 * 1024)
             file_data = None
+            try:
+                for upload in files:
+                    if upload.field == "file":
+                        with open(upload.path, "rb") as f:
+                            file_data = f.read()
+            finally:
+                for upload in files:
+                    os.remove(upload.path)
             top_k = 5
-            parts = body.split(b"--" + boundary)
-            for part in parts:
-                if b'name="file"' in part:
-                    sep_idx = part.find(b"\r\n\r\n")
-                    if sep_idx > 0:
-                        data = part[sep_idx+4:]
-                        if data.endswith(b"\r\n"):
-                            data = data[:-2]
-                        if data:
-                            file_data = data
-                elif b'name="top_k"' in part:
-                    sep_idx = part.find(b"\r\n\r\n")
-                    if sep_idx > 0:
-                        try:
-                            top_k = int(part[sep_idx+4:-2].decode().strip())
-                        except:
-                            pass
+            try:
+                top_k = int(fields.get("top_k", "5").strip())
+            except:
+                pass
 
             if not file_data:
                 self.send_response(400)
@@ -425,6 +408,8 @@ class Handler(BaseHTTPRequestHandler):
             self.send_header("Content-Type", "application/json")
             self.end_headers()
             self.wfile.write(json.dumps({"results": results}).encode())
+        except MultipartError:
+            raise
         except Exception as e:
             self.send_response(500)
             self.send_header("Content-Type", "application/json")
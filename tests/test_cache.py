@@ -0,0 +1,85 @@
+import numpy as np
+
+from app.cache import ProbeCache
+
+
+def _results(n):
+    return [{"file": f"{i}.jpg", "face_index": 0, "distance": float(i)} for i in range(n)]
+
+
+def _counting(value):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return value
+    return compute, calls
+
+
+def test_smaller_top_k_reuses_the_prefix():
+    cache = ProbeCache(1 << 20)
+    compute, calls = _counting(_results(10))
+    assert cache.results("p", ("search",), 10, 1, compute) == _results(10)
+    assert cache.results("p", ("search",), 3, 1, compute) == _results(3)
+    assert len(calls) == 1
+
+    # a larger top_k needs a new search, whose results then serve both
+    compute, calls = _counting(_results(20))
+    assert cache.results("p", ("search",), 20, 1, compute) == _results(20)
+    assert cache.results("p", ("search",), 10, 1, compute) == _results(10)
+    assert len(calls) == 1
+    # a different metric or nprobe is a different entry
+    assert cache.lookup("p", ("search", "cosine"), 1, 1) is None
+
+
+def test_results_are_copies():
+    cache = ProbeCache(1 << 20)
+    cache.store("p", ("search",), 5, 1, _results(5))
+    cache.lookup("p", ("search",), 5, 1)[0]["url"] = "/images/0.jpg"
+    assert "url" not in cache.lookup("p", ("search",), 5, 1)[0]
+
+
+def test_new_generation_drops_results_but_keeps_probes():
+    cache = ProbeCache(1 << 20)
+    encoding = np.ones(512, dtype=np.float32)
+    cache.probe("p", lambda: encoding)
+    cache.store("p", ("search",), 5, 1, _results(5))
+
+    assert cache.lookup("p", ("search",), 5, 2) is None
+    assert cache.stats()["entries"] == 1 and cache.stats()["generation"] == 2
+    compute, calls = _counting(None)
+    assert cache.probe("p", compute) is encoding and not calls
+
+
+def test_store_ignores_results_of_an_older_generation():
+    cache = ProbeCache(1 << 20)
+    cache.lookup("p", ("search",), 5, 3)
+    # a search that started before the index moved on to generation 3
+    cache.store("p", ("search",), 5, 2, _results(5))
+    assert cache.lookup("p", ("search",), 5, 3) is None
+    assert cache.lookup("p", ("search",), 5, 2) is None
+
+
+def test_byte_budget_evicts_least_recently_used():
+    one = ProbeCache(1 << 20)
+    one.probe("a", lambda: np.zeros(1000, dtype=np.float32))
+    size = one.stats()["bytes"]
+
+    cache = ProbeCache(int(size * 2.5))
+    for key in "abc":
+        cache.probe(key, lambda: np.zeros(1000, dtype=np.float32))
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1 and stats["bytes"] <= cache.max_bytes
+    compute, calls = _counting(np.zeros(1000, dtype=np.float32))
+    cache.probe("a", compute)
+    assert calls  # "a" was the least recently used
+
+
+def test_zero_budget_disables_the_cache():
+    cache = ProbeCache(0)
+    compute, calls = _counting(_results(5))
+    cache.results("p", ("search",), 5, 1, compute)
+    cache.results("p", ("search",), 5, 1, compute)
+    cache.probe("p", lambda: None)
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
@@ -0,0 +1,128 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from app.face_search import (
+    ENCODING_DIM, FaceIndex, index_folder, load_manifest, manifest_path, open_store,
+)
+
+
+def _encodings(files, faces=2, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"file": f, "face_index": i, "encoding": rng.random(ENCODING_DIM, dtype=np.float32)}
+            for f in files for i in range(faces)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = open_store(str(tmp_path / "store"))
+    store.append(_encodings(["a.jpg", "b.jpg"]))
+    return store
+
+
+def test_update_with_only_removals_on_memmapped_store(store):
+    index = FaceIndex.from_store(store)
+    assert not index.snapshot()["vectors"].flags.writeable
+
+    assert index.update([], removed_files={"never-indexed.jpg"}) == 0
+    assert len(index) == 4
+    assert index.update([], removed_files={"b.jpg"}) == 0
+    assert len(index) == 2
+    assert set(index.snapshot()["files"]) == {"a.jpg"}
+
+
+def test_update_appends_after_removal_on_memmapped_store(store):
+    index = FaceIndex.from_store(store)
+    new = _encodings(["c.jpg"], seed=1)
+    assert index.update(new, removed_files={"a.jpg"}, segment=store.append(new)) == 2
+    assert list(index.snapshot()["files"]) == ["b.jpg", "b.jpg", "c.jpg", "c.jpg"]
+    hit = index.search(new[1]["encoding"], top_k=1)[0]
+    assert (hit["file"], hit["face_index"]) == ("c.jpg", 1)
+
+
+def _write_blank(folder, name):
+    os.makedirs(folder, exist_ok=True)
+    cv2.imwrite(os.path.join(folder, name), np.full((64, 64, 3), 128, dtype=np.uint8))
+
+
+def test_index_folder_with_faceless_image(tmp_path, store, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = "images"
+    _write_blank(folder, "empty.jpg")
+    index = FaceIndex.from_store(store)
+
+    result = index_folder(folder, store, index)
+    assert result["files_indexed"] == 1 and result["faces_added"] == 0
+    assert load_manifest(manifest_path(store.root))[os.path.join(folder, "empty.jpg")]["faces"] == 0
+
+
+def test_manifest_not_saved_when_index_update_fails(tmp_path, store, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    folder = "images"
+    _write_blank(folder, "empty.jpg")
+    index = FaceIndex.from_store(store)
+
+    update, calls = index.update, []
+
+    def fail_once(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 1:
+            raise RuntimeError("update failed")
+        return update(*args, **kwargs)
+    monkeypatch.setattr(index, "update", fail_once)
+    with pytest.raises(RuntimeError):
+        index_folder(folder, store, index)
+    assert load_manifest(manifest_path(store.root)) == {}
+
+    assert index_folder(folder, store, index)["files_indexed"] == 1
+
+
+def test_update_on_mapped_columns(tmp_path, store):
+    folder = str(tmp_path / "shared")
+    os.makedirs(folder)
+    layout = FaceIndex.from_store(store).save_columns(folder)
+    index = FaceIndex(store.dim, store=store)
+    index.map_columns(folder, layout)
+    assert not index.snapshot()["files"].flags.writeable
+
+    assert index.update([], removed_files={"never-indexed.jpg"}) == 0
+    new = _encodings(["a-much-longer-file-name.jpg"], seed=2)
+    assert index.update(new, segment=store.append(new)) == 2
+    assert index.update([], removed_files={"a.jpg"}) == 0
+    assert list(index.snapshot()["files"]) == ["b.jpg", "b.jpg"] + ["a-much-longer-file-name.jpg"] * 2
+    assert index.search(new[0]["encoding"], top_k=1)[0]["file"] == "a-much-longer-file-name.jpg"
+
+
+def test_search_rejects_negative_nprobe(store):
+    index = FaceIndex.from_store(store)
+    probe = _encodings(["a.jpg"])[0]["encoding"]
+    with pytest.raises(ValueError):
+        index.search(probe, 5, nprobe=-25)
+    assert index.search(probe, 5, nprobe=0)[0]["file"] == "a.jpg"
+    assert index.search(probe, -1) == []
+
+
+def test_sqrt_vectors_kept_only_once_bhattacharyya_is_used(store):
+    index = FaceIndex.from_store(store)
+    probe = _encodings(["c.jpg"], seed=3)[0]["encoding"]
+    index.search(probe, 4, metric="euclidean")
+    assert "sqrt_vectors" not in index.snapshot()
+
+    before = index.nbytes
+    assert len(index.search(probe, 4, metric="bhattacharyya")) == 4
+    assert index.nbytes == before + index.snapshot()["vectors"].nbytes
+
+    new = _encodings(["c.jpg"], seed=3)
+    index.update(new, removed_files={"a.jpg"}, segment=store.append(new))
+    hit = index.search(probe, 1, metric="bhattacharyya")[0]
+    assert hit["file"] == "c.jpg" and hit["distance"] == pytest.approx(0, abs=1e-6)
+
+
+def test_index_folder_with_a_process_pool(tmp_path, store, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for i in range(3):
+        _write_blank("images", f"{i}.jpg")
+    result = index_folder("images", store, FaceIndex.from_store(store), workers=2, chunk_size=1)
+    assert result["files_indexed"] == 3 and result["errors"] == []
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from app.fileio import atomic_file, write_atomic
+
+
+def test_write_atomic_replaces_the_file(tmp_path):
+    path = str(tmp_path / "record.json")
+    write_atomic(path, b"old")
+    write_atomic(path, b"new", durable=False)
+    with open(path, "rb") as f:
+        assert f.read() == b"new"
+    assert os.listdir(tmp_path) == ["record.json"]
+
+
+def test_failed_write_keeps_the_old_contents(tmp_path):
+    path = str(tmp_path / "record.json")
+    write_atomic(path, b"old")
+    with pytest.raises(RuntimeError):
+        with atomic_file(path) as f:
+            f.write(b"partial")
+            raise RuntimeError("crashed mid-write")
+    with open(path, "rb") as f:
+        assert f.read() == b"old"
+    assert os.listdir(tmp_path) == ["record.json"]
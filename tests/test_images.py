@@ -0,0 +1,31 @@
+import io
+import os
+
+import pytest
+
+from app.images import ImageStore
+
+
+def test_stores_sharing_aliases_merge_names(tmp_path):
+    alias_path = str(tmp_path / "aliases.json")
+    first = ImageStore(str(tmp_path / "images"), alias_path)
+    second = ImageStore(str(tmp_path / "images"), alias_path)
+
+    rel, created = first.save(io.BytesIO(b"photo"), "IMG_0001.jpg")
+    assert created
+    first.flush()
+    other, _ = second.save(io.BytesIO(b"another photo"), "IMG_0002.jpg")
+    assert second.save(io.BytesIO(b"photo"), "party.jpg") == (rel, False)
+    second.flush()
+
+    assert first.names(rel) == ["IMG_0001.jpg", "party.jpg"]
+    assert first.names(other) == ["IMG_0002.jpg"]
+    assert ImageStore(str(tmp_path / "images"), alias_path).names(rel) == ["IMG_0001.jpg", "party.jpg"]
+
+
+def test_non_image_uploads_are_refused(tmp_path):
+    store = ImageStore(str(tmp_path / "images"), str(tmp_path / "aliases.json"))
+    assert store.accepts("IMG_0001.JPG") and not store.accepts("notes.txt") and not store.accepts("photo")
+    with pytest.raises(ValueError):
+        store.save(io.BytesIO(b"not a photo"), "notes.txt")
+    assert os.listdir(tmp_path / "images") == []
@@ -0,0 +1,27 @@
+import threading
+
+from app.jobs import IndexJobQueue
+
+
+def test_status_of_a_job_run_by_another_queue(tmp_path):
+    release = threading.Event()
+
+    def run(job):
+        job.start(1)
+        job.file_done("a.jpg", 2)
+        release.wait(5)
+        return {"faces_added": 2}
+
+    state_dir = str(tmp_path / "jobs")
+    worker, other = IndexJobQueue(run, state_dir=state_dir), IndexJobQueue(run, state_dir=state_dir)
+    job = worker.submit(saved_files=1)
+    assert other.status(job.id)["status"] in ("queued", "running")
+
+    release.set()
+    worker._queue.join()
+    state = other.status(job.id)
+    assert state["status"] == "done" and state["faces_found"] == 2
+    assert state["result"] == {"faces_added": 2}
+    assert other.status("0" * 32) is None
+    assert other.status("../" + job.id) is None
+    assert IndexJobQueue(run).status(job.id) is None
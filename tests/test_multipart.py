@@ -0,0 +1,86 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from app.multipart import MultipartError, UploadTooLarge, parse_multipart
+
+BOUNDARY = "----boundary1234"
+CONTENT_TYPE = f"multipart/form-data; boundary={BOUNDARY}"
+PHOTO = bytes(range(256)) * 40 + b"\r\n--not-the-boundary\r\n"
+
+
+def _body(parts, epilogue=b"\r\n"):
+    out = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        out += f"--{BOUNDARY}\r\nContent-Disposition: {disposition}\r\n".encode()
+        if filename is not None:
+            out += b"Content-Type: image/jpeg\r\n"
+        out += b"\r\n" + data + b"\r\n"
+    return out + f"--{BOUNDARY}--".encode() + epilogue
+
+
+def _parse(body, tmp_path, trailing=b"", **kwargs):
+    rfile = io.BytesIO(body + trailing)
+    fields, files = parse_multipart(rfile, CONTENT_TYPE, len(body), str(tmp_path), **kwargs)
+    return fields, files, rfile.read()
+
+
+BODY = _body([("top_k", None, b"7"), ("files", "a.jpg", PHOTO), ("files", "", b""),
+              ("files", "b.jpg", b"")])
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 16, 17, 64, 1 << 16])
+def test_parts_split_across_chunks(tmp_path, chunk_size):
+    fields, files, rest = _parse(BODY, tmp_path, trailing=b"NEXT", chunk_size=chunk_size)
+    assert fields == {"top_k": "7"}
+    assert [(f.filename, f.size) for f in files] == [("a.jpg", len(PHOTO)), ("b.jpg", 0)]
+    with open(files[0].path, "rb") as f:
+        assert f.read() == PHOTO
+    assert files[0].sha256 == hashlib.sha256(PHOTO).hexdigest()
+    # the rest of Content-Length is consumed, and nothing past it
+    assert rest == b"NEXT"
+
+
+def test_epilogue_is_drained(tmp_path):
+    body = _body([("files", "a.jpg", PHOTO)], epilogue=b"\r\nclient epilogue\r\n")
+    _, files, rest = _parse(body, tmp_path, trailing=b"NEXT", chunk_size=8)
+    assert len(files) == 1 and rest == b"NEXT"
+
+
+def test_on_file_receives_each_upload(tmp_path):
+    seen = []
+    _, files, _ = _parse(BODY, tmp_path, on_file=seen.append)
+    assert seen == files
+
+
+@pytest.mark.parametrize("limits", [
+    {"max_file_size": len(PHOTO) - 1},
+    {"max_field_size": 0},
+    {"max_total_size": len(BODY) - 1},
+])
+def test_size_limits(tmp_path, limits):
+    with pytest.raises(UploadTooLarge):
+        _parse(BODY, tmp_path, chunk_size=64, **limits)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize("body", [
+    BODY[:len(BODY) // 2],
+    BODY.replace(b"Content-Disposition: form-data", b"Content-Disposition: inline"),
+    b"no boundary here",
+])
+def test_malformed_bodies_leave_no_temp_files(tmp_path, body):
+    with pytest.raises(MultipartError):
+        _parse(body, tmp_path, chunk_size=16)
+    assert os.listdir(tmp_path) == []
+
+
+def test_short_body_leaves_no_temp_files(tmp_path):
+    with pytest.raises(MultipartError):
+        parse_multipart(io.BytesIO(BODY[:-40]), CONTENT_TYPE, len(BODY), str(tmp_path), chunk_size=16)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from app.face_search import ENCODING_DIM, METRICS, FaceIndex, _decode, _quantize, open_store
+
+
+def _histograms(n, seed=0):
+    # like the encoder's output: non-negative, L2-normalised, most bins near zero
+    vectors = np.random.default_rng(seed).random((n, ENCODING_DIM), dtype=np.float32) ** 4
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def store(tmp_path_factory):
+    store = open_store(str(tmp_path_factory.mktemp("store")))
+    vectors = _histograms(600)
+    for start in range(0, len(vectors), 200):
+        store.append([{"file": f"{i // 3}.jpg", "face_index": i % 3, "encoding": vectors[i]}
+                      for i in range(start, start + 200)])
+    store.delete_files({"7.jpg"})
+    return store
+
+
+@pytest.mark.parametrize("precision, max_error", [("float16", 1e-3), ("uint8", 2e-3)])
+def test_decode_round_trip(precision, max_error):
+    vectors = _histograms(100, seed=1)
+    codes = _quantize(vectors, precision, block_rows=32)
+    assert codes.dtype == (np.float16 if precision == "float16" else np.uint8)
+    assert np.abs(_decode(codes) - vectors).max() < max_error
+    assert np.abs(_decode(codes, sqrt=True) - np.sqrt(vectors)).max() < 2e-3
+
+
+@pytest.mark.parametrize("precision", ["float16", "uint8"])
+@pytest.mark.parametrize("metric", METRICS)
+def test_compact_index_matches_float32(store, precision, metric):
+    exact = FaceIndex.from_store(store)
+    compact = FaceIndex.from_store(store, precision=precision)
+    assert compact.nbytes < exact.nbytes
+    rng = np.random.default_rng(2)
+    probes = _histograms(600)[rng.choice(600, 8)] + rng.random((8, ENCODING_DIM), dtype=np.float32) * 0.01
+    expected = exact.search_batch(probes, top_k=10, metric=metric)
+    # the shortlist is re-scored from the float32 rows, so distances are identical
+    assert compact.search_batch(probes, top_k=10, metric=metric) == expected
@@ -0,0 +1,126 @@
+import http.client
+import os
+import threading
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.static_files import _etag_matches, is_fresh, make_etag, parse_range, send_file
+
+BODY = bytes(range(100))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-", (0, 99)),
+    ("bytes=10-19", (10, 19)),
+    ("bytes=90-1000", (90, 99)),
+    ("bytes=-5", (95, 99)),
+    ("bytes=-500", (0, 99)),
+    # ignored: the whole file is sent
+    (None, None),
+    ("bytes=5-2", None),
+    ("bytes=0-1,5-6", None),
+    ("items=0-1", None),
+    ("bytes=abc", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(BODY)) == expected
+
+
+@pytest.mark.parametrize("header, size", [("bytes=100-", 100), ("bytes=-0", 100), ("bytes=0-", 0)])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+def test_etag_matches():
+    assert _etag_matches('"abc"', '"abc"')
+    assert _etag_matches('W/"abc"', '"abc"')
+    assert _etag_matches('"xyz", W/"abc"', '"abc"')
+    assert _etag_matches("*", '"abc"')
+    assert not _etag_matches('"abcd"', '"abc"')
+
+
+def test_is_fresh_prefers_if_none_match():
+    mtime = 1_000_000_000
+    since = formatdate(mtime, usegmt=True)
+    assert is_fresh({"If-Modified-Since": since}, '"a"', mtime)
+    assert not is_fresh({"If-Modified-Since": formatdate(mtime - 10, usegmt=True)}, '"a"', mtime)
+    assert not is_fresh({"If-None-Match": '"b"', "If-Modified-Since": since}, '"a"', mtime)
+    assert not is_fresh({"If-Modified-Since": "yesterday"}, '"a"', mtime)
+    assert not is_fresh({}, '"a"', mtime)
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / "photo.jpg")
+    with open(path, "wb") as f:
+        f.write(BODY)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            send_file(self, path if self.path == "/photo.jpg" else path + ".missing")
+
+        def do_HEAD(self):
+            send_file(self, path, head=True)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield httpd.server_address[1], make_etag(os.stat(path))
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _get(port, headers=None, method="GET", url="/photo.jpg"):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request(method, url, headers=headers or {})
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    return resp, body
+
+
+def test_send_file_full_and_head(server):
+    port, etag = server
+    resp, body = _get(port)
+    assert resp.status == 200 and body == BODY
+    assert resp.getheader("ETag") == etag and resp.getheader("Content-Type") == "image/jpeg"
+    resp, body = _get(port, method="HEAD")
+    assert resp.status == 200 and resp.getheader("Content-Length") == "100"
+    assert _get(port, url="/other.jpg")[0].status == 404
+
+
+def test_send_file_not_modified(server):
+    port, etag = server
+    resp, body = _get(port, {"If-None-Match": "W/" + etag})
+    assert resp.status == 304 and body == b""
+    assert resp.getheader("ETag") == etag
+    assert _get(port, {"If-None-Match": '"stale"'})[0].status == 200
+
+
+def test_send_file_ranges(server):
+    port, etag = server
+    resp, body = _get(port, {"Range": "bytes=-5"})
+    assert resp.status == 206 and body == BODY[-5:]
+    assert resp.getheader("Content-Range") == "bytes 95-99/100"
+
+    resp, body = _get(port, {"Range": "bytes=100-"})
+    assert resp.status == 416 and body == b""
+    assert resp.getheader("Content-Range") == "bytes */100"
+
+    resp, body = _get(port, {"Range": "bytes=0-1,5-6"})
+    assert resp.status == 200 and body == BODY
+
+
+def test_send_file_if_range(server):
+    port, etag = server
+    resp, body = _get(port, {"Range": "bytes=10-19", "If-Range": etag})
+    assert resp.status == 206 and body == BODY[10:20]
+    # the client's copy is out of date: it gets the whole current file
+    resp, body = _get(port, {"Range": "bytes=10-19", "If-Range": '"stale"'})
+    assert resp.status == 200 and body == BODY
@@ -0,0 +1,96 @@
+import os
+
+import numpy as np
+
+import app_simple
+from app.wal import WriteAheadLog, write_checkpoint
+
+
+def _items(file, faces=2, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"file": file, "face_index": i, "encoding": rng.random(512, dtype=np.float32)}
+            for i in range(faces)]
+
+
+def _rows(encodings):
+    return [(e["file"], e["face_index"], np.asarray(e["encoding"]).tobytes()) for e in encodings]
+
+
+def test_records_replayed_in_order_after_reopen(tmp_path):
+    path = str(tmp_path / "encodings.wal")
+    log = WriteAheadLog(path)
+    for i in range(5):
+        log.append({"n": i})
+    log.close()
+    assert WriteAheadLog(path).replay() == [{"n": i} for i in range(5)]
+    assert WriteAheadLog(str(tmp_path / "missing.wal")).replay() == []
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    path = str(tmp_path / "encodings.wal")
+    log = WriteAheadLog(path)
+    log.append({"n": 0})
+    good = log.append({"n": 1})
+    log.close()
+    with open(path, "ab") as f:
+        # header promising 100 bytes, then the crash
+        f.write(b"\x00\x00\x00\x64\x00\x00\x00\x00partial")
+
+    log = WriteAheadLog(path)
+    assert log.replay() == [{"n": 0}, {"n": 1}]
+    assert os.path.getsize(path) == good
+    log.append({"n": 2})
+    log.close()
+    assert WriteAheadLog(path).replay() == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+
+def test_corrupt_record_is_truncated(tmp_path):
+    path = str(tmp_path / "encodings.wal")
+    log = WriteAheadLog(path)
+    first = log.append({"n": 0})
+    log.append({"n": 1})
+    log.close()
+    with open(path, "r+b") as f:
+        f.seek(-1, os.SEEK_END)
+        last = f.read(1)
+        f.seek(-1, os.SEEK_END)
+        f.write(bytes([last[0] ^ 0xFF]))
+
+    log = WriteAheadLog(path)
+    assert log.replay() == [{"n": 0}]
+    assert os.path.getsize(path) == first
+    log.append({"n": 2})
+    log.close()
+    assert WriteAheadLog(path).replay() == [{"n": 0}, {"n": 2}]
+
+
+def _updated_index(path):
+    index = app_simple.SharedIndex(path, checkpoint_bytes=1 << 30)
+    index.replace_files(["a.jpg"], _items("a.jpg", seed=1))
+    index.replace_files(["b.jpg"], _items("b.jpg", seed=2))
+    index.replace_files(["a.jpg", "c.jpg"], _items("c.jpg", seed=3))
+    return index
+
+
+def test_updates_replayed_after_restart(tmp_path):
+    path = str(tmp_path / "encodings.pkl")
+    expected = _rows(_updated_index(path)._encodings)
+    assert not os.path.exists(path)
+
+    reopened = app_simple.SharedIndex(path)
+    assert _rows(reopened._encodings) == expected
+    # replaying checkpoints straight away, so the log is empty again
+    assert os.path.getsize(app_simple.wal_path_for(path)) == 0
+    assert reopened.search(_items("c.jpg", seed=3)[1]["encoding"], 1)[0]["file"] == "c.jpg"
+
+
+def test_replay_onto_a_checkpoint_that_already_holds_it(tmp_path):
+    path = str(tmp_path / "encodings.pkl")
+    index = _updated_index(path)
+    expected = _rows(index._encodings)
+    # crash between write_checkpoint and the log reset: the pickle has every record too
+    write_checkpoint(index._encodings, path)
+    assert WriteAheadLog(app_simple.wal_path_for(path)).replay()
+
+    assert _rows(app_simple.SharedIndex(path)._encodings) == expected
+    assert _rows(app_simple.SharedIndex(path)._encodings) == expected